@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+import random
+import numpy as np
+
+from gameState import GameState
+from randomTape import RandomTape
+from flatTree import StackedTrees
+from controllers import AttackerController, DefenderController
+
+class BatchGameState:
+    """
+    Class to hold the state of many games at once and play them in lockstep.
+
+    Each game variable that GameState keeps as a member is kept here as an
+    array with one entry per game, and a turn is played for every live game
+    at once with vectorized random draws and masks instead of per-game
+    branches. The rules are the same as GameState.play_turn; see there for
+    the details of a turn.
+
+    Only the basic model without CA classifiers is supported, and no world
+    data is logged.
+    """
+
+    ATTACK = GameState.ACTION_CODES['attack']
+    LISTEN = GameState.ACTION_CODES['listen']
+    BLOCK = GameState.ACTION_CODES['block']
+
+
+    def __init__(self, params, attackers, defenders, tape = None):
+        """
+        Set up one game per (attacker, defender) pair, given the experiment's
+        GameParams and equal-length lists of Attacker and Defender ExprTrees.
+        Game i reads its random values from row i of the given RandomTape; if
+        no tape is given, one is drawn from seeds taken from the random module.
+        """
+        self.params = params
+
+        self.attackers = attackers
+        self.defenders = defenders
+        self.num_games = len(attackers)
+
+        # game invariants and measurements, one per game:
+        self.t = np.zeros(self.num_games, dtype=np.int64)
+        self.state = np.full(self.num_games, GameState.UNBLOCKED, dtype=np.int64)
+        self.time_blocked = np.zeros(self.num_games, dtype=np.int64)
+        self.A_u = np.zeros(self.num_games, dtype=np.int64)
+        self.omega = np.zeros(self.num_games, dtype=np.int64)
+        self.attacker_reward = np.zeros(self.num_games, dtype=np.int64)
+        # last turn's behavior value and mask (all that BH() and BM() read)
+        self.behavior = np.zeros(self.num_games)
+        self.behavior_mask = np.zeros(self.num_games, dtype=bool)
+
+        # Indices of the games that aren't over yet. All games start together
+        # so the live ones are always on the same turn.
+        self.live = np.arange(self.num_games)
+        self.turn = 0
+
+        if (tape is None):
+            tape = RandomTape([random.getrandbits(128) for _ in range(self.num_games)],
+                              params.lambda_u, min(params.time_limit, RandomTape.CHUNK))
+        self.tape = tape
+
+        # Group games by tree, and stack the distinct trees so every game's
+        # move is decided in one vectorized pass per turn
+        self.attacker_groups = BatchGameState.group_by_tree(attackers)
+        self.attacker_trees = BatchGameState.stack_trees(self.attacker_groups,
+                                                         AttackerController, self.num_games)
+        self.defender_groups = BatchGameState.group_by_tree(defenders)
+        if (params.defender_strategy == 'ccegp'):
+            self.defender_trees = BatchGameState.stack_trees(self.defender_groups,
+                                                             DefenderController, self.num_games)
+
+        # Attacker-only evolution ends a game with a passive attacker right
+        # away; this is constant over the game so check it once up front
+        self.passive = np.zeros(self.num_games, dtype=bool)
+        if (params.defender_strategy == 'saritas'):
+            for tree, rows in self.attacker_groups:
+                self.passive[rows] = tree.is_passive()
+
+
+    @staticmethod
+    def group_by_tree(trees):
+        """
+        Return a list of (tree, indices of the games that tree plays in).
+        """
+        groups = {}
+        for index, tree in enumerate(trees):
+            if (id(tree) not in groups):
+                groups[id(tree)] = (tree, [])
+            groups[id(tree)][1].append(index)
+        return [(tree, np.array(rows)) for tree, rows in groups.values()]
+
+
+    @staticmethod
+    def stack_trees(groups, controller, num_games):
+        """
+        Given the tree groups of one side and its Controller class, return
+        (StackedTrees of the distinct trees, the index of each game's tree in
+        the stack, the action code of each spec of the stack).
+        """
+        specs = controller.functions + controller.terminals
+        stack = StackedTrees([tree for tree, rows in groups], specs)
+        tree_index = np.zeros(num_games, dtype=np.int64)
+        for index, (tree, rows) in enumerate(groups):
+            tree_index[rows] = index
+        codes = np.array([GameState.ACTION_CODES.get(spec[0], 0) for spec in specs], dtype=np.int8)
+        return stack, tree_index, codes
+
+
+    def decide_moves(self, trees, precalcs, live):
+        """
+        Evaluate each live game's tree, given the side's stacked trees (see
+        stack_trees), and return the action codes of the live games.
+        """
+        stack, tree_index, codes = trees
+        return codes[stack.calc(tree_index[live], stack.features(precalcs, live))]
+
+
+    def play_turn(self):
+        """
+        Play one turn of every live game, then retire the games that ended.
+        """
+        live = self.live
+        params = self.params
+
+        self.turn += 1
+        self.tape.ensure(self.turn)
+        self.t[live] += 1
+        t = self.t[live]
+        traffic = self.tape.traffic[live, self.turn - 1]
+        noise = self.tape.noise[live, self.turn - 1]
+        uniforms = self.tape.uniforms[live, self.turn - 1]
+        state = self.state[live]
+        blocked = (state == GameState.BLOCKED)
+        unblocked = ~blocked
+        self.time_blocked[live] += blocked
+
+        # Attackers
+        attacker_moves = self.decide_moves(self.attacker_trees,
+                                           {'T': self.t,
+                                            'B': self.state,
+                                            'AO': self.omega,
+                                            'AR': self.attacker_reward},
+                                           live)
+        attack = (attacker_moves == BatchGameState.ATTACK)
+        listen = (attacker_moves == BatchGameState.LISTEN)
+
+        # Users generate traffic where the game state allows
+        traffic = np.where(unblocked, traffic, 0)
+        self.A_u[live] += traffic
+
+        # An attack subsumes any user traffic (see GameState.play_turn)
+        attacking = attack & unblocked
+        using = ~attacking & (traffic > 0)
+        behavior_mask = attacking | using
+        omega = np.minimum(self.omega[live], len(params.omega_decay) - 1)
+        scale = np.where(attacking, 1 + params.omega_decay[omega], 1.0)
+        behavior = np.where(behavior_mask,
+                            (params.beta_u + params.sigma_u * noise) * scale, 0.0)
+        self.behavior[live] = behavior
+        self.behavior_mask[live] = behavior_mask
+
+        # Defenders
+        if (params.defender_strategy == 'ccegp'):
+            defender_moves = self.decide_moves(self.defender_trees,
+                                               {'BM': self.behavior_mask,
+                                                'BH': self.behavior,
+                                                'T': self.t},
+                                               live)
+            block = (defender_moves == BatchGameState.BLOCK)
+        else:
+            block = blocked | (behavior_mask & (behavior > params.c_r))
+
+        # transition to blocked if the defender decides to block, and remain
+        # blocked with probability q if already blocked
+        new_state = state.copy()
+        new_state[unblocked & block] = GameState.BLOCKED
+        unblock = blocked & (uniforms[:, RandomTape.UNBLOCK] >= params.q)
+        new_state[unblock] = GameState.UNBLOCKED
+
+        # IDS checks and attacker bookkeeping
+        detected = listen & (uniforms[:, RandomTape.LISTEN] < params.delta_l)
+        self.omega[live] += np.where(listen & ~detected, traffic, 0)
+        if (not params.IDLess):
+            attack_detected = attack & (uniforms[:, RandomTape.ATTACK] < params.delta_a)
+        else:
+            attack_detected = attack & block
+        self.attacker_reward[live] += (attack & ~attack_detected
+                                       & (new_state != GameState.BLOCKED) & ~block)
+        detected |= attack_detected
+        new_state[detected] = GameState.ATTACKER_DETECTED
+        self.state[live] = new_state
+
+        # Retire finished games
+        game_over = detected | (t >= params.time_limit) | self.passive[live]
+        self.live = live[~game_over]
+
+
+    def play(self):
+        """
+        Play turns until every game is over.
+        """
+        while (len(self.live) > 0):
+            self.play_turn()
+
+
+    def calculate_attacker_fitness(self):
+        """
+        Calculate and return an array of fitness for the attacker of each game
+        """
+        return self.attacker_reward * self.params.discount[self.t]
+
+
+    def calculate_defender_fitness(self):
+        """
+        Calculate and return an array of fitness for the defender of each game
+        """
+        return (self.params.user_bonus * self.A_u
+                - self.params.attacker_penalty * self.attacker_reward) / self.t
@@ -1,14 +1,22 @@
 # -*- coding: utf-8 -*-
+import io
 import random
-import copy
 import traceback
+import math
 import numpy
 import sys
+import multiprocessing
 
 from strategy import Strategy
-from gameState import GameState
+from gameState import GameState, WorldTrace
+from batchGameState import BatchGameState
+from randomTape import RandomTape
+from exactEvaluator import ExactEvaluator
+from gameCache import GameCache
+from gamePool import GamePool
 from controllers import AttackerController, DefenderController
 from exprTree import Node, ExprTree
+from flatTree import FlatTree
 from population import Population
 from ciaoPlotter import CIAOPlotter
 
@@ -17,12 +25,102 @@ class CCEGPStrategy(Strategy):
     """
     Competitive Co-Evolutionary Genetic Programming search strategy.
     """
+
+    # Number of pairs of games replayed each generation to estimate the
+    # variance reduction from common random numbers
+    CRN_PROBE_PAIRS = 5
+
     def __init__(self, experiment):
         self.experiment = experiment
 
         # How to perform generation evals
         self.gen_evals = 'one_vs_one'
 
+        # How to play the games of a generation: one at a time (serial) or
+        # all at once in lockstep (batch)
+        self.game_engine = 'serial'
+
+        # How to score Attackers: by playing games, or (against the saritas
+        # defender only) by their exact expected score
+        self.attacker_evaluation = 'games'
+        self.exact_evaluator = None
+        # How many trees' exact scores to remember
+        self.exact_cache_size = 10000
+
+        # Should the games of a generation share their random numbers
+        # (common random numbers), and in blocks of how many games (0 = the
+        # whole generation)?
+        self.common_random_numbers = False
+        self.crn_block_size = 0
+        # Do the shared seeds change every generation, or stay the same for
+        # the whole run (so the same pairing in the same block replays the
+        # same game)?
+        self.crn_scope = 'generation'
+        # Run totals of squared score differences between games with shared
+        # (paired) and independent (unpaired) random numbers
+        self.crn_paired_sq = numpy.zeros(2)
+        self.crn_unpaired_sq = numpy.zeros(2)
+
+        # Should generation evals race, playing extra games for the
+        # individuals whose place relative to the ea_mu survival cutoff is
+        # still in doubt? At most racing_budget extra games are played per
+        # generation, and an individual is in doubt while the cutoff lies
+        # within racing_z standard errors of its average fitness.
+        self.racing = False
+        self.racing_budget = 100
+        self.racing_z = 1.96
+        # Number of extra games racing has played in the current run
+        self.racing_games = 0
+        # Latest pooled variance of an individual's game fitnesses for each
+        # population (by name), which individuals with a single game take
+        self.racing_variances = {}
+
+        # Should a game between trees that duplicate those of an earlier game
+        # in the same round (with its random numbers, under common random
+        # numbers) take that game's scores instead of being played?
+        self.skip_duplicate_games = False
+        # Run totals of individuals that duplicated another (by canonical
+        # hash) in their generation's evals, and of games skipped for it
+        self.duplicate_attackers = 0
+        self.duplicate_defenders = 0
+        self.duplicate_games = 0
+
+        # Should trees be simplified (see ExprTree.simplify) rather than just
+        # cleaned after initialization and variation?
+        self.simplify_trees = False
+
+        # Does variation work on trees of linked Nodes (node), copying just
+        # the path down to the change, or on their FlatTree arrays (flat),
+        # slicing subtrees in and out? The offspring are the same either way.
+        self.genome = 'node'
+
+        # Node of the experiment's seed sequence tree that the current
+        # generation's game seeds are spawned from, and with crn_scope = run,
+        # the node the run's shared seeds are
+        self.generation_seed_sequence = None
+        self.crn_seed_sequence = None
+
+        # Cache of game outcomes by trees and seed holding at most
+        # game_cache_size games (none if 0)
+        self.game_cache_size = 0
+        self.game_cache = None
+
+        # How many worker processes play seeded games in parallel (none if
+        # 0), and the GamePool of them, which lasts for a run
+        self.workers = 0
+        self.game_pool = None
+
+        # How many islands, each an Attacker and Defender population pair
+        # evolving in a process of its own (none if 0: the run's one pair
+        # evolves in this process). Every migration_interval generations each
+        # island sends copies of its migration_size best Attackers and
+        # Defenders to the next island around a ring, in island order (ring)
+        # or in an order drawn anew each time (random).
+        self.islands = 0
+        self.migration_interval = 10
+        self.migration_size = 2
+        self.migration_topology = 'ring'
+
         # Information for setting up and controlling the Attacker population
         self.attacker_controllers = [None for _ in range(experiment.num_attackers)]
         self.attacker_mu = 10
@@ -65,6 +163,159 @@ class CCEGPStrategy(Strategy):
         except:
             print('config: gen_evals not specified; using', self.gen_evals)
 
+        try:
+            self.game_engine = experiment.config_parser.get('ccegp_options', 'game_engine').lower()
+            print('config: game_engine =', self.game_engine)
+        except:
+            print('config: game_engine not specified; using', self.game_engine)
+        if (self.game_engine not in ['serial', 'batch']):
+            print('Unknown game engine:', self.game_engine)
+            sys.exit(1)
+
+        # The batch engine only implements the basic model
+        if (self.game_engine == 'batch' and len(experiment.ca_classifiers) > 0):
+            print('config: batch game_engine does not support ca_classifiers; using serial')
+            self.game_engine = 'serial'
+
+        try:
+            self.attacker_evaluation = experiment.config_parser.get('ccegp_options',
+                                                                    'attacker_evaluation').lower()
+            print('config: attacker_evaluation =', self.attacker_evaluation)
+        except:
+            print('config: attacker_evaluation not specified; using', self.attacker_evaluation)
+
+        try:
+            self.exact_cache_size = experiment.config_parser.getint('ccegp_options', 'exact_cache_size')
+            print('config: exact_cache_size =', self.exact_cache_size)
+        except:
+            print('config: exact_cache_size not specified; using', self.exact_cache_size)
+
+        # The exact evaluator only knows the saritas defender and the basic model
+        if (self.attacker_evaluation == 'exact'):
+            if (experiment.defender_strategy != 'saritas' or len(experiment.ca_classifiers) > 0):
+                print('config: exact attacker_evaluation needs the saritas defender without ca_classifiers; using games')
+                self.attacker_evaluation = 'games'
+            else:
+                self.exact_evaluator = ExactEvaluator(experiment.game_params, self.exact_cache_size)
+
+        try:
+            self.common_random_numbers = experiment.config_parser.getboolean('ccegp_options',
+                                                                            'common_random_numbers')
+            print('config: common_random_numbers =', self.common_random_numbers)
+        except:
+            print('config: common_random_numbers not specified; using', self.common_random_numbers)
+
+        try:
+            self.crn_block_size = experiment.config_parser.getint('ccegp_options', 'crn_block_size')
+            print('config: crn_block_size =', self.crn_block_size)
+        except:
+            print('config: crn_block_size not specified; using', self.crn_block_size)
+
+        try:
+            self.crn_scope = experiment.config_parser.get('ccegp_options', 'crn_scope').lower()
+            print('config: crn_scope =', self.crn_scope)
+        except:
+            print('config: crn_scope not specified; using', self.crn_scope)
+        if (self.crn_scope not in ['generation', 'run']):
+            print('Unknown CRN scope:', self.crn_scope)
+            sys.exit(1)
+
+        try:
+            self.game_cache_size = experiment.config_parser.getint('ccegp_options', 'game_cache_size')
+            print('config: game_cache_size =', self.game_cache_size)
+        except:
+            print('config: game_cache_size not specified; using', self.game_cache_size)
+        if (self.game_cache_size > 0):
+            self.game_cache = GameCache(self.game_cache_size)
+
+        try:
+            self.workers = experiment.config_parser.getint('ccegp_options', 'workers')
+            print('config: workers =', self.workers)
+        except:
+            print('config: workers not specified; using', self.workers)
+
+        try:
+            self.islands = experiment.config_parser.getint('ccegp_options', 'islands')
+            print('config: islands =', self.islands)
+        except:
+            print('config: islands not specified; using', self.islands)
+
+        try:
+            self.migration_interval = experiment.config_parser.getint('ccegp_options',
+                                                                      'migration_interval')
+            print('config: migration_interval =', self.migration_interval)
+        except:
+            print('config: migration_interval not specified; using', self.migration_interval)
+
+        try:
+            self.migration_size = experiment.config_parser.getint('ccegp_options', 'migration_size')
+            print('config: migration_size =', self.migration_size)
+        except:
+            print('config: migration_size not specified; using', self.migration_size)
+
+        try:
+            self.migration_topology = experiment.config_parser.get('ccegp_options',
+                                                                   'migration_topology').lower()
+            print('config: migration_topology =', self.migration_topology)
+        except:
+            print('config: migration_topology not specified; using', self.migration_topology)
+
+        # Exact evaluation has no sampling noise to share
+        if (self.common_random_numbers and self.attacker_evaluation == 'exact'):
+            print('config: common_random_numbers has no effect with exact attacker_evaluation')
+            self.common_random_numbers = False
+
+        try:
+            self.racing = experiment.config_parser.getboolean('ccegp_options', 'racing')
+            print('config: racing =', self.racing)
+        except:
+            print('config: racing not specified; using', self.racing)
+
+        try:
+            self.racing_budget = experiment.config_parser.getint('ccegp_options', 'racing_budget')
+            print('config: racing_budget =', self.racing_budget)
+        except:
+            print('config: racing_budget not specified; using', self.racing_budget)
+
+        try:
+            self.racing_z = experiment.config_parser.getfloat('ccegp_options', 'racing_z')
+            print('config: racing_z =', self.racing_z)
+        except:
+            print('config: racing_z not specified; using', self.racing_z)
+
+        # Exact scores are already settled
+        if (self.racing and self.attacker_evaluation == 'exact'):
+            print('config: racing has no effect with exact attacker_evaluation')
+            self.racing = False
+        # With one game each, every individual's single score leaves it in
+        # doubt, so racing would spend most of the run's evals replaying the
+        # population
+        if (self.racing and self.gen_evals == 'one_vs_one'):
+            print('config: racing needs gen_evals = all_vs_all; turning it off')
+            self.racing = False
+
+        try:
+            self.skip_duplicate_games = experiment.config_parser.getboolean('ccegp_options',
+                                                                           'skip_duplicate_games')
+            print('config: skip_duplicate_games =', self.skip_duplicate_games)
+        except:
+            print('config: skip_duplicate_games not specified; using', self.skip_duplicate_games)
+
+        try:
+            self.simplify_trees = experiment.config_parser.getboolean('ccegp_options', 'simplify_trees')
+            print('config: simplify_trees =', self.simplify_trees)
+        except:
+            print('config: simplify_trees not specified; using', self.simplify_trees)
+
+        try:
+            self.genome = experiment.config_parser.get('ccegp_options', 'genome').lower()
+            print('config: genome =', self.genome)
+        except:
+            print('config: genome not specified; using', self.genome)
+        if (self.genome not in ['node', 'flat']):
+            print('Unknown genome:', self.genome)
+            sys.exit(1)
+
         try:
             self.attacker_mu = experiment.config_parser.getint('ccegp_options', 'attacker_mu')
             print('config: attacker_mu =', self.attacker_mu)
@@ -266,6 +517,26 @@ class CCEGPStrategy(Strategy):
 
         # Write configuration items to log file
         experiment.log_file.write('gen_evals: ' + self.gen_evals + '\n')
+        experiment.log_file.write('game_engine: ' + self.game_engine + '\n')
+        experiment.log_file.write('attacker_evaluation: ' + self.attacker_evaluation + '\n')
+        if (self.attacker_evaluation == 'exact'):
+            experiment.log_file.write('exact_cache_size: ' + str(self.exact_cache_size) + '\n')
+        experiment.log_file.write('common_random_numbers: ' + str(self.common_random_numbers) + '\n')
+        experiment.log_file.write('crn_block_size: ' + str(self.crn_block_size) + '\n')
+        experiment.log_file.write('crn_scope: ' + self.crn_scope + '\n')
+        experiment.log_file.write('game_cache_size: ' + str(self.game_cache_size) + '\n')
+        experiment.log_file.write('workers: ' + str(self.workers) + '\n')
+        experiment.log_file.write('islands: ' + str(self.islands) + '\n')
+        if (self.islands > 0):
+            experiment.log_file.write('migration_interval: ' + str(self.migration_interval) + '\n')
+            experiment.log_file.write('migration_size: ' + str(self.migration_size) + '\n')
+            experiment.log_file.write('migration_topology: ' + self.migration_topology + '\n')
+        experiment.log_file.write('racing: ' + str(self.racing) + '\n')
+        experiment.log_file.write('racing_budget: ' + str(self.racing_budget) + '\n')
+        experiment.log_file.write('racing_z: ' + str(self.racing_z) + '\n')
+        experiment.log_file.write('skip_duplicate_games: ' + str(self.skip_duplicate_games) + '\n')
+        experiment.log_file.write('simplify_trees: ' + str(self.simplify_trees) + '\n')
+        experiment.log_file.write('genome: ' + self.genome + '\n')
         experiment.log_file.write('attacker_mu: ' + str(self.attacker_mu) + '\n')
         experiment.log_file.write('attacker_lambda: ' + str(self.attacker_lambda) + '\n')
         experiment.log_file.write('attacker_dmax_init: ' + str(self.attacker_dmax_init) + '\n')
@@ -312,6 +583,15 @@ class CCEGPStrategy(Strategy):
             return None
 
 
+    def __getstate__(self):
+        # Run workers (see Experiment) get their own parsimony log buffer and
+        # game pool
+        state = self.__dict__.copy()
+        state['parsimony_log'] = None
+        state['game_pool'] = None
+        return state
+
+
     def initialize_population(self, pop):
         """
         Given an empty population, generate and return an initial population
@@ -331,8 +611,28 @@ class CCEGPStrategy(Strategy):
             else:
                 pop.individuals[i].build_tree(pop, root, 0, pop.dmax_init, 'grow')
 
-            pop.individuals[i].clean_tree()
-            pop.individuals[i].root.reset_metrics()
+            self.clean_tree(pop.individuals[i])
+
+
+    def clean_tree(self, tree, changed = None):
+        """
+        Clean up a new or varied tree and reset its metrics: simplify it if
+        simplify_trees is set, otherwise just clean it. If changed is given,
+        the tree was clean until the subtree at the end of that path (from
+        ExprTree.copy_path) was rebuilt or swapped, so (unless simplifying,
+        which depends on the tests above the change) only that subtree and
+        its path to the root need redoing. Either way the finished tree's
+        subtrees are then shared with identical ones (see ExprTree.intern).
+        """
+        if (self.simplify_trees):
+            tree.simplify()
+            tree.root.reset_metrics()
+        elif (changed is not None):
+            tree.clean_changed(changed)
+        else:
+            tree.clean_tree()
+            tree.root.reset_metrics()
+        tree.intern()
 
 
     def random_selection_without_replacement(self, pop, num_to_select):
@@ -498,19 +798,19 @@ class CCEGPStrategy(Strategy):
         """
         Given a population and a parent, return a mutated offspring
         """
-        # Start with a copy of the parent
-        offspring = copy.deepcopy(parent)
+        if (self.genome == 'flat'):
+            return self.mutate_flat(pop, parent)
 
-        # Randomly pick a node in the expression tree
-        selected_node = offspring.root.find_nth_node(random.randint(1, offspring.root.size))
+        # Randomly pick a node in the expression tree, and start with a copy of
+        # the parent that shares everything but the path down to that node
+        offspring, path = parent.copy_path(random.randint(1, parent.root.size))
 
         # Build a new (sub)tree there. Arbitrarily choose 'grow' method and limit depth to dmax_overall.
-        offspring.build_tree(pop, selected_node, selected_node.depth, pop.dmax_overall, 'grow')
+        offspring.build_tree(pop, path[-1], len(path) - 1, pop.dmax_overall, 'grow')
 
-        # clean the tree to remove non-branches
-        offspring.clean_tree()
-        # Reset the tree metrics we just screwed up
-        offspring.root.reset_metrics()
+        # clean the tree to remove non-branches, and reset the tree metrics
+        # we just screwed up
+        self.clean_tree(offspring, path)
 
         return offspring
 
@@ -519,39 +819,97 @@ class CCEGPStrategy(Strategy):
         """
         Given a population and two parents, return two recombined offspring.
         """
-        # Start with copies of the parents
-        offspring1 = copy.deepcopy(parent1)
-        offspring2 = copy.deepcopy(parent2)
+        if (self.genome == 'flat'):
+            return self.recombine_flat(pop, parent1, parent2)
 
         # Randomly pick nodes from each tree and swap them.
         match_found = False
         while (not(match_found)):
             # Pick a node in each tree
-            selected_node1 = offspring1.root.find_nth_node(random.randint(1, offspring1.root.size))
-            selected_node2 = offspring2.root.find_nth_node(random.randint(1, offspring2.root.size))
+            n1 = random.randint(1, parent1.root.size)
+            n2 = random.randint(1, parent2.root.size)
 
             # If the swap would cause either offspring to exceed Dmax,
             # try again.
-            if (((selected_node1.depth + selected_node2.height) > pop.dmax_overall)
-                or ((selected_node2.depth + selected_node1.height) > pop.dmax_overall)):
+            if (((parent1.nth_depth(n1) + parent2.nth_node(n2).height) > pop.dmax_overall)
+                or ((parent2.nth_depth(n2) + parent1.nth_node(n1).height) > pop.dmax_overall)):
                 continue
 
-            # Match found -- make swap
-            temp_node = Node()
-            temp_node.copy(selected_node1)
-            selected_node1.copy(selected_node2)
-            selected_node2.copy(temp_node)
+            # Match found -- make swap in copies of the parents that share
+            # everything but the paths down to the swapped nodes
+            offspring1, path1 = parent1.copy_path(n1)
+            offspring2, path2 = parent2.copy_path(n2)
+            path1[-1].swap(path2[-1])
             match_found = True
 
-        offspring1.clean_tree()
-        offspring2.clean_tree()
-        # Reset the tree metrics we just screwed up
-        offspring1.root.reset_metrics()
-        offspring2.root.reset_metrics()
+        # clean the trees, and reset the tree metrics we just screwed up
+        self.clean_tree(offspring1, path1)
+        self.clean_tree(offspring2, path2)
 
         return [offspring1, offspring2]
 
 
+    def mutate_flat(self, pop, parent):
+        """
+        Given a population and a parent, return the same mutated offspring as
+        mutate, made by replacing a slice of the parent's FlatTree arrays
+        """
+        specs = pop.functions + pop.terminals
+        flat = FlatTree.from_tree(parent, specs)
+
+        # Randomly pick a node (by its breadth-first number, as mutate does)
+        # and grow a new subtree for its place
+        index = flat.breadth_first()[random.randint(1, len(flat)) - 1]
+        subtree = ExprTree(Node())
+        subtree.build_tree(pop, subtree.root, int(flat.depths()[index]), pop.dmax_overall, 'grow')
+
+        # A terminal grown in place of an internal node keeps its children,
+        # as with build_tree in mutate (see Node.calc)
+        grown = FlatTree.from_tree(subtree, specs)
+        if (len(grown) == 1):
+            offspring = flat.relabel(index, grown).to_tree()
+        else:
+            offspring = flat.replace(index, grown).to_tree()
+        self.clean_tree(offspring)
+
+        return offspring
+
+
+    def recombine_flat(self, pop, parent1, parent2):
+        """
+        Given a population and two parents, return the same two recombined
+        offspring as recombine, made by swapping slices of the parents'
+        FlatTree arrays
+        """
+        specs = pop.functions + pop.terminals
+        flat1 = FlatTree.from_tree(parent1, specs)
+        flat2 = FlatTree.from_tree(parent2, specs)
+        order1 = flat1.breadth_first()
+        order2 = flat2.breadth_first()
+        depths1 = flat1.depths()
+        depths2 = flat2.depths()
+
+        # Randomly pick nodes from each tree and swap them.
+        match_found = False
+        while (not(match_found)):
+            # Pick a node in each tree
+            index1 = order1[random.randint(1, len(flat1)) - 1]
+            index2 = order2[random.randint(1, len(flat2)) - 1]
+
+            # If the swap would cause either offspring to exceed Dmax,
+            # try again.
+            if (((depths1[index1] + flat2.height(index2)) > pop.dmax_overall)
+                or ((depths2[index2] + flat1.height(index1)) > pop.dmax_overall)):
+                continue
+            match_found = True
+
+        offspring = [flat.to_tree() for flat in flat1.swap(index1, flat2, index2)]
+        for tree in offspring:
+            self.clean_tree(tree)
+
+        return offspring
+
+
     def recombine_mutate(self, pop, parents):
         """
         Given a population and a set of parents, return a set of offspring
@@ -594,14 +952,20 @@ class CCEGPStrategy(Strategy):
             sys.exit(1)
 
 
-    def execute_one_game(self, attacker_individual, defender_individual):
+    def execute_one_game(self, attacker_individual, defender_individual, trace_level = None,
+                         tape = None):
         """
         Execute one game / eval of a run given a Attacker individual and
         Defender individual selected from their respective populations.
+        The game is recorded in self.experiment.world_data at the given trace
+        level, or the experiment's if none is given, and reads its random
+        numbers from the given single-row RandomTape, if any.
         """
         # Pick a new scenario and set up a new game state.
-        self.experiment.world_data = []
-        game_state = GameState(self.experiment)
+        if (trace_level is None):
+            trace_level = self.experiment.trace_level
+        self.experiment.world_data = WorldTrace(trace_level, self.experiment.game_time_limit)
+        game_state = GameState(self.experiment.game_params, tape)
 
         # Create new Attacker and Defender controllers
         for curr_attacker_id in range(self.experiment.num_attackers):
@@ -617,28 +981,285 @@ class CCEGPStrategy(Strategy):
                                              self.attacker_controllers,
                                              self.defender_controllers)
 
-        # Set Attacker fitness and implement parsimony pressure
-        attacker_individual.fitness = game_state.calculate_attacker_fitness()
-        if (self.attacker_pop.parsimony_technique == 'size'):
-            attacker_individual.fitness -= (self.attacker_pop.pppc * attacker_individual.root.size)
-        else:
-            attacker_individual.fitness -= (self.attacker_pop.pppc * attacker_individual.root.height)
-
-        # Set Defender fitness and implement parsimony pressure
-        defender_individual.fitness = game_state.calculate_defender_fitness()
-        if (self.defender_pop.parsimony_technique == 'size'):
-            defender_individual.fitness -= (self.defender_pop.pppc * defender_individual.root.size)
-        else:
-            defender_individual.fitness -= (self.defender_pop.pppc * defender_individual.root.height)
-
         # Set Attacker and Defender scores
         # Score is raw game score without parsimony pressure for Attacker
         attacker_individual.score = game_state.calculate_attacker_fitness()
         defender_individual.score = game_state.calculate_defender_fitness()
 
+        # Set Attacker and Defender fitness and implement parsimony pressure
+        attacker_individual.fitness = self.apply_parsimony(self.attacker_pop, attacker_individual,
+                                                           attacker_individual.score)
+        defender_individual.fitness = self.apply_parsimony(self.defender_pop, defender_individual,
+                                                           defender_individual.score)
+
         # print('Game over: Attacker', game_state.attacker_score, '/ Defender', game_state.defender_score)
 
 
+    def apply_parsimony(self, pop, individual, score):
+        """
+        Return the fitness of an individual given its raw game score by
+        applying the population's parsimony pressure.
+        """
+        if (pop.parsimony_technique == 'size'):
+            return score - (pop.pppc * individual.root.size)
+        else:
+            return score - (pop.pppc * individual.root.height)
+
+
+    def play_games(self, pairings, seeds = None):
+        """
+        Play one game for each (Attacker individual, Defender individual) pair
+        in pairings using the configured game engine. Return a list of the
+        raw (Attacker score, Defender score) of each game in pairing order.
+        With exact attacker evaluation the expected scores stand in for games.
+
+        If seeds are given, game i draws its random numbers from seeds[i];
+        games with the same seed see the same user traffic, behavior and
+        detection draws. Otherwise every game draws its own. Seeded games
+        already in the game cache (if there is one) aren't played again.
+        """
+        if (self.attacker_evaluation == 'exact'):
+            return [self.exact_evaluator.evaluate(attacker_individual)
+                    for attacker_individual, defender_individual in pairings]
+
+        if ((self.game_cache is None) or (seeds is None)):
+            return self.play_uncached_games(pairings, seeds)
+
+        keys = [GameCache.key(attacker_individual, defender_individual, seed)
+                for (attacker_individual, defender_individual), seed in zip(pairings, seeds)]
+        scores = [self.game_cache.get(key) for key in keys]
+        missing = [curr_game for curr_game, game_scores in enumerate(scores) if (game_scores is None)]
+        if (len(missing) > 0):
+            missing_scores = self.play_uncached_games([pairings[curr_game] for curr_game in missing],
+                                                      [seeds[curr_game] for curr_game in missing])
+            for curr_game, game_scores in zip(missing, missing_scores):
+                self.game_cache.put(keys[curr_game], game_scores)
+                scores[curr_game] = game_scores
+        return scores
+
+
+    def play_uncached_games(self, pairings, seeds = None):
+        """
+        Play the games of play_games (without exact evaluation) without
+        looking in the game cache; seeded games go to the worker processes,
+        if there are any.
+        """
+        if ((self.game_pool is not None) and (seeds is not None)):
+            return self.game_pool.play_games(pairings, seeds)
+
+        if (self.game_engine == 'batch'):
+            tape = None
+            if (seeds is not None):
+                tape = self.game_tape(seeds)
+            batch = BatchGameState(self.experiment.game_params,
+                                   [pairing[0] for pairing in pairings],
+                                   [pairing[1] for pairing in pairings], tape)
+            batch.play()
+            return list(zip(batch.calculate_attacker_fitness().tolist(),
+                            batch.calculate_defender_fitness().tolist()))
+
+        # Games with the same seed share one tape
+        tapes = {}
+        scores = []
+        for curr_game, (attacker_individual, defender_individual) in enumerate(pairings):
+            tape = None
+            if (seeds is not None):
+                seed = seeds[curr_game]
+                if (seed not in tapes):
+                    tapes[seed] = self.game_tape([seed])
+                tape = tapes[seed]
+            self.execute_one_game(attacker_individual, defender_individual, tape = tape)
+            scores.append((attacker_individual.score, defender_individual.score))
+        return scores
+
+
+    def game_tape(self, seeds):
+        """
+        Return a RandomTape with a row for each of the given seeds.
+        """
+        params = self.experiment.game_params
+        return RandomTape(seeds, params.lambda_u, min(params.time_limit, RandomTape.CHUNK))
+
+
+    @staticmethod
+    def seed_keys(seeds):
+        """
+        Return the spawn keys of a list of game seeds (SeedSequences) as
+        text, with runs of consecutive keys written first-last and runs of
+        the same key (common random numbers) written key xN.
+        """
+        groups = []  # [first key, last key, number of games]
+        for seed in seeds:
+            key = seed.spawn_key
+            if (len(groups) > 0):
+                first, last, count = groups[-1]
+                if ((key == last) and (first == last)):
+                    groups[-1][2] += 1
+                    continue
+                if ((key[:-1] == last[:-1]) and (key[-1] == last[-1] + 1)
+                    and (count == last[-1] - first[-1] + 1)):
+                    groups[-1][1] = key
+                    groups[-1][2] += 1
+                    continue
+            groups.append([key, key, 1])
+        return ', '.join(str(first) if (count == 1) else
+                         (str(first) + ' x' + str(count)) if (first == last) else
+                         (str(first) + '-' + str(last))
+                         for first, last, count in groups)
+
+
+    def log_seeds(self, label, seeds):
+        """
+        Write the spawn keys of the given game seeds to the log, so that any
+        of the games can be replayed from the experiment's random seed and
+        its key (numpy.random.SeedSequence(abs(random_seed), spawn_key = key)).
+        """
+        self.experiment.log_file.write(label + ' seeds: ' + CCEGPStrategy.seed_keys(seeds) + '\n')
+
+
+    def game_seeds(self, num_games, common = False):
+        """
+        Return a seed for each of num_games games of the current generation,
+        spawned from the generation's seed sequence. With common random
+        numbers each block of crn_block_size games (or all of them, if that's
+        0) shares one seed, which with crn_scope = run is the same for the
+        same block in every generation.
+        """
+        if (not common):
+            return self.generation_seed_sequence.spawn(num_games)
+        block_size = self.crn_block_size if (self.crn_block_size > 0) else max(num_games, 1)
+        num_blocks = math.ceil(num_games / block_size)
+        if (self.crn_scope == 'run'):
+            # Block i takes the run's i-th shared seed, every generation
+            parent = self.crn_seed_sequence
+            block_seeds = [numpy.random.SeedSequence(parent.entropy,
+                                                     spawn_key = parent.spawn_key + (block,))
+                           for block in range(num_blocks)]
+        else:
+            block_seeds = self.generation_seed_sequence.spawn(num_blocks)
+        return [block_seeds[curr_game // block_size] for curr_game in range(num_games)]
+
+
+    def measure_crn(self, pairings, seeds, scores):
+        """
+        Sample how much common random numbers reduce the variance of score
+        differences between games. Up to CRN_PROBE_PAIRS pairs of neighboring
+        games that shared a seed are replayed with independent random numbers
+        (not counted as evals), and the squared Attacker and Defender score
+        differences of both versions are added to the run totals.
+        """
+        probes = [curr_game for curr_game in range(0, len(pairings) - 1, 2)
+                  if seeds[curr_game] == seeds[curr_game + 1]]
+        probes = probes[:CCEGPStrategy.CRN_PROBE_PAIRS]
+        if (len(probes) == 0):
+            return
+
+        replay_seeds = self.game_seeds(2 * len(probes))
+        self.log_seeds('CRN probe', replay_seeds)
+        replays = self.play_games([pairings[curr_game + offset]
+                                   for curr_game in probes for offset in (0, 1)],
+                                  replay_seeds)
+        for curr_probe, curr_game in enumerate(probes):
+            paired = numpy.subtract(scores[curr_game], scores[curr_game + 1])
+            unpaired = numpy.subtract(replays[2 * curr_probe], replays[2 * curr_probe + 1])
+            self.crn_paired_sq += paired ** 2
+            self.crn_unpaired_sq += unpaired ** 2
+
+
+    def crn_variance_reduction(self):
+        """
+        Return the run's estimated (Attacker, Defender) fractional reduction in
+        the variance of score differences from common random numbers, or None
+        for either if it couldn't be measured.
+        """
+        return tuple(1 - paired / unpaired if (unpaired > 0) else None
+                     for paired, unpaired in zip(self.crn_paired_sq, self.crn_unpaired_sq))
+
+
+    def duplicate_sources(self, pairings, seeds):
+        """
+        Return, for each game of a round, the index of the game whose scores
+        it takes: its own, or with skip_duplicate_games, that of the first
+        game between trees with the same canonical hashes (and, under common
+        random numbers, the same seed, so the skipped game would have come
+        out exactly the same).
+        """
+        if (not self.skip_duplicate_games):
+            return list(range(len(pairings)))
+        first_games = {}
+        sources = []
+        for curr_game, (attacker_individual, defender_individual) in enumerate(pairings):
+            key = (attacker_individual.canonical_hash(), defender_individual.canonical_hash(),
+                   seeds[curr_game] if (self.common_random_numbers) else None)
+            sources.append(first_games.setdefault(key, curr_game))
+        return sources
+
+
+    def racing_undecided(self, pop, fitnesses):
+        """
+        Given a population and the list of game fitnesses of each of its
+        individuals so far, return the indices of the individuals that can't
+        yet be placed on either side of the truncation cutoff at ea_mu: those
+        whose average fitness is within racing_z standard errors of the
+        cutoff.
+
+        An individual with a single game has no variance of its own, so it
+        takes the pooled variance of the individuals with more games, or
+        before any have more, the population's pooled variance from the last
+        generation that had some (the variance of all of its games in the
+        run's first generation).
+        """
+        if (len(fitnesses) <= pop.ea_mu):
+            return []
+
+        # The cutoff lies halfway between the last survivor and the first
+        # individual left out
+        averages = [numpy.mean(individual_fitnesses) for individual_fitnesses in fitnesses]
+        ranked = sorted(averages, reverse = True)
+        cutoff = (ranked[pop.ea_mu - 1] + ranked[pop.ea_mu]) / 2
+
+        replicated = [individual_fitnesses for individual_fitnesses in fitnesses
+                      if (len(individual_fitnesses) > 1)]
+        if (len(replicated) > 0):
+            pooled_variance = sum((len(individual_fitnesses) - 1) * numpy.var(individual_fitnesses, ddof = 1)
+                                  for individual_fitnesses in replicated) \
+                / sum(len(individual_fitnesses) - 1 for individual_fitnesses in replicated)
+            self.racing_variances[pop.pop_name] = pooled_variance
+        elif (pop.pop_name in self.racing_variances):
+            pooled_variance = self.racing_variances[pop.pop_name]
+        else:
+            pooled_variance = numpy.var([fitness for individual_fitnesses in fitnesses
+                                         for fitness in individual_fitnesses], ddof = 1)
+
+        undecided = []
+        for index, individual_fitnesses in enumerate(fitnesses):
+            variance = pooled_variance
+            if (len(individual_fitnesses) > 1):
+                variance = numpy.var(individual_fitnesses, ddof = 1)
+            std_error = math.sqrt(variance / len(individual_fitnesses))
+            if (abs(averages[index] - cutoff) < self.racing_z * std_error):
+                undecided.append(index)
+        return undecided
+
+
+    def racing_indices(self, attackers, defenders, attacker_fitnesses, defender_fitnesses,
+                       max_games):
+        """
+        Return the (Attacker index, Defender index) pairs of the next round of
+        racing, along with which of the two ('attacker' or 'defender') each
+        game is for: one game against a random opponent for every Attacker
+        and Defender still in doubt, at most max_games of them in all.
+        """
+        indices = [((attacker_index, random.randrange(len(defenders))), 'attacker')
+                   for attacker_index in self.racing_undecided(self.attacker_pop, attacker_fitnesses)]
+        indices += [((random.randrange(len(attackers)), defender_index), 'defender')
+                    for defender_index in self.racing_undecided(self.defender_pop, defender_fitnesses)]
+        if (len(indices) > max_games):
+            random.shuffle(indices)
+            indices = indices[:max_games]
+        return [pair for pair, _ in indices], [raced for _, raced in indices]
+
+
     def generation_evals(self, attackers, defenders, eval_count, evals_with_no_change, attacker_gen_high_fitness):
         """
         Run evaluations of the Attacker vs Defender populations given Attacker and Defender
@@ -648,88 +1269,126 @@ class CCEGPStrategy(Strategy):
 
         Run games with Attacker vs Defender from the provided populations.
         Average fitnesses of multiple evaluations of the same individual.
+
+        The generation's games take their seeds from a new child of the run's
+        seed sequence (or with crn_scope = run, from the run's shared seeds).
+        Which child that is depends on what else the run has spawned (with
+        crn_scope = run and islands, for instance), and racing rounds and CRN
+        probes take seeds of their own, so each round's seeds are written to
+        the log by spawn key (see log_seeds), in game order. Exact attacker
+        evaluation plays no games, so it takes (and logs) no seeds.
         """
+        self.generation_seed_sequence = self.experiment.run_seed_sequence.spawn(1)[0]
+
+        # Count the individuals that duplicate another in the generation
+        self.duplicate_attackers += len(attackers) - len({attacker.canonical_hash()
+                                                          for attacker in attackers})
+        self.duplicate_defenders += len(defenders) - len({defender.canonical_hash()
+                                                          for defender in defenders})
 
         if (self.gen_evals == 'one_vs_one'):
             # METHOD 1: Evaluate each attacker once.
             # USES O(N) EVALUATIONS
 
-            # Set up matrices to hold per-game fitness values for Attacker and Defender
-            attacker_fitnesses = [[] for _ in range(len(attackers))]
-            defender_fitnesses = [[] for _ in range(len(defenders))]
-
             # Shuffle the attackers and defenders, then play each Attacker against one Defender
             random.shuffle(attackers)
             random.shuffle(defenders)
             num_games = max(len(attackers), len(defenders))
-            for curr_game in range(num_games):
-                # If num attackers < num defenders, some attackers will go multiple times
-                attacker_index = curr_game % len(attackers)
-                # If num defenders < num attackers, some defenders will go multiple times
-                defender_index = curr_game % len(defenders)
-                attacker_individual = attackers[attacker_index]
-                defender_individual = defenders[defender_index]
-                self.execute_one_game(attacker_individual, defender_individual)
-                # Save the fitness in a list so we can average the results later
-                attacker_fitnesses[attacker_index].append(attacker_individual.fitness)
-                defender_fitnesses[defender_index].append(defender_individual.fitness)
-
-                # Bookkeeping
-                eval_count += 1
-                if (attacker_individual.fitness <= attacker_gen_high_fitness):
-                    evals_with_no_change += 1
-                else:
-                    evals_with_no_change = 0
-
-                # # Provide status message every nth evaluation.
-                # if ((eval_count % 10) == 0):
-                #     print('\r', eval_count, 'evals', end =" ")
-
-            # Set the fitness of each Attacker and Defender to the average of its list of fitnesses
-            for attacker_index in range(len(attackers)):
-                attackers[attacker_index].fitness = numpy.mean(attacker_fitnesses[attacker_index])
-            for defender_index in range(len(defenders)):
-                defenders[defender_index].fitness = numpy.mean(defender_fitnesses[defender_index])
+            # If num attackers < num defenders, some attackers will go multiple times
+            # If num defenders < num attackers, some defenders will go multiple times
+            indices = [(curr_game % len(attackers), curr_game % len(defenders))
+                       for curr_game in range(num_games)]
 
         elif (self.gen_evals == 'all_vs_all'):
             # METHOD 2: Play every Attacker against every Defender and average fitnesses
             # USES O(N^2) EVALUATIONS
-
-            # Set up matrices to hold per-game fitness values for Attacker and Defender
-            attacker_fitnesses = numpy.zeros((len(self.attacker_pop.individuals),
-                                          len(self.defender_pop.individuals)))
-            defender_fitnesses = numpy.zeros((len(self.defender_pop.individuals),
-                                            len(self.attacker_pop.individuals)))
-            # Play every Attacker against every Defender and perform bookkeeping
-            for attacker_index in range(len(self.attacker_pop.individuals)):
-                attacker_individual = self.attacker_pop.individuals[attacker_index]
-                for defender_index in range(len(self.defender_pop.individuals)):
-                    defender_individual = self.defender_pop.individuals[defender_index]
-                    self.execute_one_game(attacker_individual, defender_individual)
-                    attacker_fitnesses[attacker_index][defender_index] = attacker_individual.fitness
-                    defender_fitnesses[defender_index][attacker_index] = defender_individual.fitness
-                    # Bookkeeping
-                    eval_count += 1
-                    if (attacker_individual.fitness <= attacker_gen_high_fitness):
-                        evals_with_no_change += 1
-                    else:
-                        evals_with_no_change = 0
-                    # Provide status message every nth evaluation.
-                    if ((eval_count % 100) == 0):
-                        print('\r', eval_count, 'evals', end =" ")
-            # Set the fitness of each Attacker to the mean of its fitnesses against every Defender
-            # and vice-versa for the Defenders.
-            for attacker_index in range(len(self.attacker_pop.individuals)):
-                attacker_individual = self.attacker_pop.individuals[attacker_index]
-                attacker_individual.fitness = numpy.mean(attacker_fitnesses[attacker_index])
-            for defender_index in range(len(self.defender_pop.individuals)):
-                defender_individual = self.defender_pop.individuals[defender_index]
-                defender_individual.fitness = numpy.mean(defender_fitnesses[defender_index])
+            indices = [(attacker_index, defender_index)
+                       for attacker_index in range(len(attackers))
+                       for defender_index in range(len(defenders))]
 
         else:
-            print('Unknown generation evaluation method:', self.gen_eval)
+            print('Unknown generation evaluation method:', self.gen_evals)
             sys.exit(1)
 
+        # Set up lists to hold per-game fitness values for Attacker and Defender
+        attacker_fitnesses = [[] for _ in range(len(attackers))]
+        defender_fitnesses = [[] for _ in range(len(defenders))]
+
+        # Play all of the generation's games, then (if racing) rounds of extra
+        # games for the individuals still in doubt, until none are or the
+        # racing budget runs out
+        racing_budget = self.racing_budget
+        if (self.termination == 'number_of_evals'):
+            racing_budget = min(racing_budget,
+                                self.experiment.num_fitness_evals_per_run - eval_count - len(indices))
+        # Which individual each game is for: both players in the first round,
+        # only the one being raced after that, so that the opponents it
+        # happens to draw don't get extra games of their own
+        raced = [None for _ in indices]
+        first_round = True
+        while (len(indices) > 0):
+            # Play the round's games, with common random numbers if configured
+            pairings = [(attackers[attacker_index], defenders[defender_index])
+                        for attacker_index, defender_index in indices]
+            # Exact scores don't come from games, so they take no seeds
+            seeds = [None for _ in pairings]
+            if (self.attacker_evaluation != 'exact'):
+                seeds = self.game_seeds(len(pairings), self.common_random_numbers)
+                self.log_seeds('game', seeds)
+            # Play each game not skipped as a duplicate, and give every game
+            # the scores of the game it duplicates (itself, if played)
+            sources = self.duplicate_sources(pairings, seeds)
+            played = sorted(set(sources))
+            played_scores = self.play_games([pairings[curr_game] for curr_game in played],
+                                            [seeds[curr_game] for curr_game in played])
+            played_scores = dict(zip(played, played_scores))
+            scores = [played_scores[source] for source in sources]
+            self.duplicate_games += len(pairings) - len(played)
+            if (self.common_random_numbers and first_round):
+                self.measure_crn(pairings, seeds, scores)
+
+            for curr_game, ((attacker_index, defender_index), (attacker_score, defender_score)) \
+                in enumerate(zip(indices, scores)):
+                # Save the fitness in a list so we can average the results later
+                attacker_fitness = None
+                if (raced[curr_game] != 'defender'):
+                    attacker_individual = attackers[attacker_index]
+                    attacker_individual.score = attacker_score
+                    attacker_fitness = self.apply_parsimony(self.attacker_pop, attacker_individual,
+                                                            attacker_score)
+                    attacker_fitnesses[attacker_index].append(attacker_fitness)
+                if (raced[curr_game] != 'attacker'):
+                    defender_individual = defenders[defender_index]
+                    defender_individual.score = defender_score
+                    defender_fitness = self.apply_parsimony(self.defender_pop, defender_individual,
+                                                            defender_score)
+                    defender_fitnesses[defender_index].append(defender_fitness)
+
+                # Bookkeeping (skipped games aren't evals)
+                if (sources[curr_game] == curr_game):
+                    eval_count += 1
+                if ((attacker_fitness is None) or (attacker_fitness <= attacker_gen_high_fitness)):
+                    evals_with_no_change += 1
+                else:
+                    evals_with_no_change = 0
+
+                # Provide status message every nth evaluation.
+                if (self.gen_evals == 'all_vs_all' and (eval_count % 100) == 0):
+                    print('\r', eval_count, 'evals', end =" ")
+
+            first_round = False
+            indices = []
+            if (self.racing and racing_budget > 0):
+                indices, raced = self.racing_indices(attackers, defenders, attacker_fitnesses,
+                                                     defender_fitnesses, racing_budget)
+                racing_budget -= len(indices)
+                self.racing_games += len(indices)
+
+        # Set the fitness of each Attacker and Defender to the average of its list of fitnesses
+        for attacker_index in range(len(attackers)):
+            attackers[attacker_index].fitness = numpy.mean(attacker_fitnesses[attacker_index])
+        for defender_index in range(len(defenders)):
+            defenders[defender_index].fitness = numpy.mean(defender_fitnesses[defender_index])
 
         return eval_count, evals_with_no_change
 
@@ -745,19 +1404,29 @@ class CCEGPStrategy(Strategy):
         num_gens = len(self.attacker_pop.best_individuals)
 
         fitnesses = numpy.zeros((num_gens, num_gens))
-        eval_count = 0
+        # Seed the games from the run's seed sequence, like the generations';
+        # with common random numbers they all share one seed, so the same
+        # bests meeting again (a best that held for several generations)
+        # replay the same game, which the game cache can answer
+        seed_sequence = self.experiment.run_seed_sequence.spawn(1)[0]
         print('CIAO: play', num_gens, 'generations of bests')
-        for defender in range(num_gens):
-            for attacker in range(defender, num_gens):
-                self.execute_one_game(self.attacker_pop.best_individuals[attacker],
-                                      self.defender_pop.best_individuals[defender])
-                eval_count += 1
-                # 0,0 is lower left, so adjust the row index
-                fitnesses[num_gens - attacker - 1][defender] = self.attacker_pop.best_individuals[attacker].fitness
-
-                # # Provide status message every nth evaluation.
-                # if ((eval_count % 10) == 0):
-                #     print('\r', eval_count, 'evals', end = ' ')
+        cells = [(attacker, defender) for defender in range(num_gens)
+                 for attacker in range(defender, num_gens)]
+        if (self.attacker_evaluation == 'exact'):
+            seeds = None
+        elif (self.common_random_numbers):
+            seeds = seed_sequence.spawn(1) * len(cells)
+        else:
+            seeds = seed_sequence.spawn(len(cells))
+        if (seeds is not None):
+            self.log_seeds('CIAO', seeds)
+        scores = self.play_games([(self.attacker_pop.best_individuals[attacker],
+                                   self.defender_pop.best_individuals[defender])
+                                  for attacker, defender in cells], seeds)
+        for (attacker, defender), (attacker_score, defender_score) in zip(cells, scores):
+            # 0,0 is lower left, so adjust the row index
+            fitnesses[num_gens - attacker - 1][defender] = self.apply_parsimony(
+                self.attacker_pop, self.attacker_pop.best_individuals[attacker], attacker_score)
 
         # Normalize fitnesses to [0.0 - 1.0] where 1.0 is best
         min_fitness = numpy.min(fitnesses)
@@ -785,17 +1454,229 @@ class CCEGPStrategy(Strategy):
                          fitnesses)
 
 
-    def execute_one_run(self):
+    def migration_routes(self, islands, rng):
         """
-        Execute one run of an experiment.
+        Return a (source, destination) pair for each of the given islands
+        (numbers of islands still evolving) for a round of migration: around a
+        ring in island order, or with the random topology, around a ring in an
+        order drawn from the numpy Generator rng.
+        """
+        if (self.migration_topology == 'random'):
+            islands = [islands[index] for index in rng.permutation(len(islands))]
+        return [(islands[index], islands[(index + 1) % len(islands)])
+                for index in range(len(islands))]
 
-        Return highest score and its associated world and solution data.
+
+    def emigrants(self, pop):
         """
-        # Initialize run values of populations
-        self.attacker_pop.reset_run_values()
-        self.defender_pop.reset_run_values()
+        Return the migration_size best individuals of a population.
+        """
+        return sorted(pop.individuals, key = lambda individual: individual.fitness,
+                      reverse = True)[:self.migration_size]
+
+
+    def immigrate(self, pop, immigrants):
+        """
+        Put immigrants into a population in place of its worst individuals.
+        They're evaluated with everyone else in the next generation.
+        """
+        worst = sorted(range(len(pop.individuals)), key = lambda index: pop.individuals[index].fitness)
+        for index, immigrant in zip(worst, immigrants):
+            pop.individuals[index] = immigrant
 
-        self.parsimony_log.write('\nRun ' + str(self.experiment.curr_run) + '\n')
+
+    def migrate(self, connection):
+        """
+        Send an island's emigrants through its connection to the main process
+        (see run_islands) and take in the immigrants it sends back.
+        """
+        connection.send(('migrants', self.emigrants(self.attacker_pop),
+                         self.emigrants(self.defender_pop)))
+        attacker_immigrants, defender_immigrants = connection.recv()
+        self.immigrate(self.attacker_pop, attacker_immigrants)
+        self.immigrate(self.defender_pop, defender_immigrants)
+
+
+    @staticmethod
+    def execute_island(strategy, seed_sequence, connection):
+        """
+        Evolve an island's populations in a process of its own (see
+        run_islands) on its share of the run's evals, taking its random
+        numbers from seed_sequence and trading migrants through connection,
+        then send back its populations, run totals and what it wrote to the
+        log (its game seeds).
+        """
+        experiment = strategy.experiment
+        # The run's logs are written by the main process from what the
+        # islands send back
+        experiment.log_file = io.StringIO()
+        strategy.parsimony_log = io.StringIO()
+        experiment.run_seed_sequence = seed_sequence
+        random.seed(int(seed_sequence.generate_state(1, numpy.uint64)[0]))
+        # The run's eval budget is shared out among the islands
+        experiment.num_fitness_evals_per_run //= strategy.islands
+        if (strategy.workers > 0):
+            strategy.game_pool = GamePool(strategy.workers, experiment.game_params,
+                                          strategy.game_engine)
+
+        strategy.evolve(connection)
+
+        if (strategy.game_pool is not None):
+            strategy.game_pool.shutdown()
+        cache_counts = (0, 0)
+        if (strategy.game_cache is not None):
+            cache_counts = (strategy.game_cache.hits, strategy.game_cache.lookups)
+        connection.send(('done', strategy.attacker_pop, strategy.defender_pop,
+                         (strategy.racing_games, strategy.duplicate_attackers,
+                          strategy.duplicate_defenders, strategy.duplicate_games,
+                          strategy.crn_paired_sq, strategy.crn_unpaired_sq) + cache_counts,
+                         experiment.log_file.getvalue()))
+        connection.close()
+
+
+    def run_islands(self):
+        """
+        Evolve the run's islands in processes of their own, passing migrants
+        between them until they've all terminated, then take their results
+        together as the run's (see combine_islands).
+
+        Each island takes its random numbers from its own child of the run's
+        seed sequence, and migration rounds wait for every island still
+        evolving, so a run comes out the same however the islands are
+        scheduled.
+        """
+        if (self.migration_topology not in ['ring', 'random']):
+            print('Unknown migration topology:', self.migration_topology)
+            sys.exit(1)
+
+        island_seed_sequences = self.experiment.run_seed_sequence.spawn(self.islands)
+        topology_rng = numpy.random.default_rng(self.experiment.run_seed_sequence.spawn(1)[0])
+
+        # Flush first, so islands started by forking don't inherit unwritten
+        # output
+        self.experiment.log_file.flush()
+        self.parsimony_log.flush()
+        connections = []
+        processes = []
+        for island in range(self.islands):
+            connection, island_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = CCEGPStrategy.execute_island,
+                                              args = (self, island_seed_sequences[island],
+                                                      island_connection))
+            process.start()
+            # Keep only the island's end open there, so the main process
+            # hears about an island that dies
+            island_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        results = [None for _ in range(self.islands)]
+        try:
+            # Every round, each island still evolving either sends its
+            # emigrants and waits for immigrants, or has terminated and sends
+            # its results
+            evolving = list(range(self.islands))
+            while (len(evolving) > 0):
+                migrants = {}
+                for island in evolving:
+                    message = connections[island].recv()
+                    if (message[0] == 'done'):
+                        results[island] = message[1:]
+                    else:
+                        migrants[island] = message[1:]
+                evolving = sorted(migrants)
+                immigrants = {island: ([], []) for island in evolving}
+                if (len(evolving) > 1):
+                    for source, destination in self.migration_routes(evolving, topology_rng):
+                        immigrants[destination] = migrants[source]
+                for island in evolving:
+                    connections[island].send(immigrants[island])
+        except:
+            # Don't leave the other islands waiting on migrants forever
+            for process in processes:
+                process.terminate()
+            raise
+        for process in processes:
+            process.join()
+
+        self.combine_islands(results)
+
+
+    def combine_islands(self, results):
+        """
+        Take the islands' results (populations, run totals and log text, as
+        sent by execute_island) together as the run's: log each generation's
+        stats of all the islands still evolving at that generation as one
+        population's, keep the best individual of every generation across
+        islands for the CIAO plot, and the best of the run across islands.
+        Each island's summary line is followed by its game seeds.
+        """
+        pops = [(self.attacker_pop, [attacker_pop for attacker_pop, _, _, _ in results]),
+                (self.defender_pop, [defender_pop for _, defender_pop, _, _ in results])]
+        num_gens = max(len(attacker_pop.generation_stats) for attacker_pop in pops[0][1])
+        for generation in range(num_gens):
+            for pop, island_pops in pops:
+                # Islands that have terminated still count their evals
+                eval_count = sum(island_pop.generation_stats[min(generation,
+                                                                 len(island_pop.generation_stats) - 1)][0]
+                                 for island_pop in island_pops)
+                island_pops = [island_pop for island_pop in island_pops
+                               if (len(island_pop.generation_stats) > generation)]
+                stats = Population.combine_gen_stats([island_pop.generation_stats[generation][1]
+                                                      for island_pop in island_pops])
+                pop.generation_stats.append((eval_count, stats))
+                Population.write_logs(pop.pop_name, eval_count, stats, self.experiment.log_file,
+                                      self.parsimony_log)
+                pop.best_individuals.append(max([island_pop.best_individuals[generation]
+                                                 for island_pop in island_pops],
+                                                key = lambda individual: individual.fitness))
+
+        for island, (attacker_pop, defender_pop, totals, log_text) in enumerate(results):
+            self.experiment.log_file.write('island ' + str(island + 1) + ': generations '
+                                           + str(len(attacker_pop.generation_stats))
+                                           + ', evals ' + str(attacker_pop.generation_stats[-1][0])
+                                           + ', Attacker high fitness '
+                                           + str(attacker_pop.run_high_fitness)
+                                           + ', Defender high fitness '
+                                           + str(defender_pop.run_high_fitness) + '\n')
+            self.experiment.log_file.write(log_text)
+            racing_games, duplicate_attackers, duplicate_defenders, duplicate_games, \
+                crn_paired_sq, crn_unpaired_sq, cache_hits, cache_lookups = totals
+            self.racing_games += racing_games
+            self.duplicate_attackers += duplicate_attackers
+            self.duplicate_defenders += duplicate_defenders
+            self.duplicate_games += duplicate_games
+            self.crn_paired_sq += crn_paired_sq
+            self.crn_unpaired_sq += crn_unpaired_sq
+            if (self.game_cache is not None):
+                self.game_cache.hits += cache_hits
+                self.game_cache.lookups += cache_lookups
+
+        for pop, island_pops in pops:
+            best_pop = max(island_pops, key = lambda island_pop: island_pop.run_high_fitness)
+            pop.run_high_fitness = best_pop.run_high_fitness
+            pop.run_best_individual = best_pop.run_best_individual
+            pop.run_high_score = max(island_pop.run_high_score for island_pop in island_pops)
+
+
+    def evolve(self, connection = None):
+        """
+        Evolve the Attacker and Defender populations from initialization to
+        termination.
+
+        Given a connection, the populations are an island's (see run_islands),
+        and trade migrants through it every migration_interval generations.
+        """
+        if (self.crn_scope == 'run'):
+            self.crn_seed_sequence = self.experiment.run_seed_sequence.spawn(1)[0]
+
+        # An island's generation lines are written by the main process, taken
+        # together with the other islands' (see combine_islands)
+        experiment_log = self.experiment.log_file
+        parsimony_log = self.parsimony_log
+        if (connection is not None):
+            experiment_log = io.StringIO()
+            parsimony_log = io.StringIO()
 
         generation = 1
         print('\rGeneration', generation, end = ' ')
@@ -814,9 +1695,9 @@ class CCEGPStrategy(Strategy):
 
             # Update generation bookkeeping
             self.attacker_pop.generation_bookkeeping()
-            self.attacker_pop.update_logs(eval_count, self.experiment.log_file, self.parsimony_log)
+            self.attacker_pop.update_logs(eval_count, experiment_log, parsimony_log)
             self.defender_pop.generation_bookkeeping()
-            self.defender_pop.update_logs(eval_count, self.experiment.log_file, self.parsimony_log)
+            self.defender_pop.update_logs(eval_count, experiment_log, parsimony_log)
 
             # Update run bookkeeping
             self.attacker_pop.calc_run_stats()
@@ -836,6 +1717,10 @@ class CCEGPStrategy(Strategy):
 
             # Not terminating? Let's proceed!
 
+            # Trade migrants with the other islands
+            if ((connection is not None) and (generation % self.migration_interval == 0)):
+                self.migrate(connection)
+
             generation += 1
             print('\rGeneration', generation, end = ' ')
 
@@ -861,15 +1746,80 @@ class CCEGPStrategy(Strategy):
             self.defender_pop.individuals = self.select_survivors(self.defender_pop)
 
 
+    def execute_one_run(self):
+        """
+        Execute one run of an experiment.
+
+        Return highest score and its associated world and solution data.
+        """
+        # Initialize run values of populations
+        self.attacker_pop.reset_run_values()
+        self.defender_pop.reset_run_values()
+
+        self.parsimony_log.write('\nRun ' + str(self.experiment.curr_run) + '\n')
+        self.crn_paired_sq = numpy.zeros(2)
+        self.crn_unpaired_sq = numpy.zeros(2)
+        self.racing_games = 0
+        self.racing_variances = {}
+        self.duplicate_attackers = 0
+        self.duplicate_defenders = 0
+        self.duplicate_games = 0
+        if (self.game_cache is not None):
+            self.game_cache.reset_counts()
+
+        if (self.islands > 0):
+            # Islands start game pools of their own
+            self.run_islands()
+            if (self.workers > 0):
+                self.game_pool = GamePool(self.workers, self.experiment.game_params, self.game_engine)
+        else:
+            if (self.workers > 0):
+                self.game_pool = GamePool(self.workers, self.experiment.game_params, self.game_engine)
+            self.evolve()
+
+        if (self.common_random_numbers):
+            attacker_reduction, defender_reduction = self.crn_variance_reduction()
+            print('\nCRN variance reduction: Attacker', attacker_reduction,
+                  '/ Defender', defender_reduction)
+            self.experiment.log_file.write('CRN variance reduction: Attacker '
+                                           + str(attacker_reduction) + ' / Defender '
+                                           + str(defender_reduction) + '\n')
+
+        if (self.racing):
+            print('\nRacing games:', self.racing_games)
+            self.experiment.log_file.write('racing games: ' + str(self.racing_games) + '\n')
+
+        print('\nDuplicate individuals: Attacker', self.duplicate_attackers,
+              '/ Defender', self.duplicate_defenders)
+        self.experiment.log_file.write('duplicate individuals: Attacker '
+                                       + str(self.duplicate_attackers) + ' / Defender '
+                                       + str(self.duplicate_defenders) + '\n')
+        if (self.skip_duplicate_games):
+            print('Duplicate games skipped:', self.duplicate_games)
+            self.experiment.log_file.write('duplicate games skipped: '
+                                           + str(self.duplicate_games) + '\n')
+
         # Do CIAO plot here
         self.ciao_plot()
 
+        if (self.game_pool is not None):
+            self.game_pool.shutdown()
+            self.game_pool = None
+
+        if (self.game_cache is not None):
+            print('Game cache hits:', self.game_cache.hits, 'of', self.game_cache.lookups)
+            self.experiment.log_file.write('game cache hits: ' + str(self.game_cache.hits)
+                                           + ' of ' + str(self.game_cache.lookups) + '\n')
+
         # Play "exhibition game" to get best world data (does not count against Eval total).
         # This has a side effect of setting self.experiment.world_data
         print('Exhibition game: Attacker', self.attacker_pop.run_best_individual.fitness,
               'vs Defender', self.defender_pop.run_best_individual.fitness)
+        exhibition_seeds = self.experiment.run_seed_sequence.spawn(1)
+        self.log_seeds('exhibition', exhibition_seeds)
         self.execute_one_game(self.attacker_pop.run_best_individual,
-                              self.defender_pop.run_best_individual)
+                              self.defender_pop.run_best_individual, trace_level = 'full',
+                              tape = self.game_tape(exhibition_seeds))
 
         return self.attacker_pop.run_high_fitness, self.experiment.world_data, \
             str(self.attacker_pop.run_best_individual.root), \
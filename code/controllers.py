@@ -15,16 +15,15 @@ class Controller():
 
 
     @staticmethod
-    def fill_precalcs(functions, game_state):
+    def fill_precalcs(features, game_state):
         """
-        Precalculate the game state values before evaluating the tree
-        so we don't recalculate "static" values repeatedly (static within
-        the scope of a single tree evalution)
+        Precalculate the game state values the tree reads (the names in
+        features) before evaluating the tree so we don't recalculate "static"
+        values repeatedly (static within the scope of a single tree evalution)
         """
         precalcs = {}
-        for function in functions:
-            if (function[0] != 'constant'):
-                precalcs[function[0]] = getattr(game_state, function[0])()
+        for feature in features:
+            precalcs[feature] = getattr(game_state, feature)()
         return precalcs
 
 
@@ -55,8 +54,8 @@ class AttackerController(Controller):
         """
         # print('------------------\n' + str(self.tree.root))
         # Set the next move
-        self.next_move = self.tree.root.calc(Controller.fill_precalcs(self.functions,
-                                                                      game_state))
+        self.next_move = self.tree.calc(Controller.fill_precalcs(self.tree.summarize().features,
+                                                                 game_state))
 
 
 class DefenderController(Controller):
@@ -79,7 +78,7 @@ class DefenderController(Controller):
         the action with the expected best payoff
         """
         # Set the next move
-        self.next_move = self.tree.root.calc(Controller.fill_precalcs(self.functions,
-                                                                      game_state))
+        self.next_move = self.tree.calc(Controller.fill_precalcs(self.tree.summarize().features,
+                                                                 game_state))
 
 
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+from scipy.stats import norm, poisson
+
+from gameState import GameState
+from gameCache import GameCache
+
+class ExactEvaluator:
+    """
+    Exact expected game scores for Attackers playing the static "saritas"
+    defender.
+
+    Against the saritas defender a game is a Markov chain over (t, state,
+    omega, attacker_reward) driven only by the Attacker's tree, so instead
+    of sampling games the distribution over that chain is stepped forward
+    one turn at a time and the scores of the games ending at each turn are
+    added up as they go. The distribution is kept as one entry per (state,
+    omega, attacker_reward) a game can be in; entries whose probability
+    falls below TOLERANCE are dropped, and omega values past the point where
+    neither the tree nor the attacker's behavior can tell them apart are
+    lumped together. The rules are the same as GameState.play_turn; see
+    there for the details of a turn.
+    """
+
+    # Probability below which an entry of the distribution is dropped
+    TOLERANCE = 1e-15
+
+    WAIT = GameState.ACTION_CODES['wait']
+    LISTEN = GameState.ACTION_CODES['listen']
+    ATTACK = GameState.ACTION_CODES['attack']
+
+
+    def __init__(self, params, cache_size):
+        """
+        Set up an evaluator given the experiment's GameParams, remembering
+        the scores of at most cache_size trees.
+        """
+        self.params = params
+
+        # Chance that the user's behavior is over the cut-off
+        self.user_over_cutoff = norm.sf(params.c_r, params.beta_u, params.sigma_u)
+        # Chance that the user's traffic gets them blocked in a turn, and the
+        # expected traffic of the turns that do
+        self.user_block = -math.expm1(-params.lambda_u) * self.user_over_cutoff
+        self.user_block_traffic = params.lambda_u * self.user_over_cutoff
+
+        # Distribution of a turn's user traffic, cut off where the tail no
+        # longer matters, and the chance of each amount getting the user blocked
+        max_traffic = int(poisson.isf(ExactEvaluator.TOLERANCE, params.lambda_u)) + 1
+        self.traffic_amounts = np.arange(max_traffic + 1)
+        self.traffic_pmf = poisson.pmf(self.traffic_amounts, params.lambda_u)
+        self.traffic_block = np.where(self.traffic_amounts > 0, self.user_over_cutoff, 0.0)
+
+        # Chance that an attack gets blocked, indexed by omega (extended as needed)
+        self.attack_block = np.zeros(0)
+
+        # Scores of the trees evaluated most recently, by canonical hash
+        self.cache = GameCache(cache_size)
+
+
+    def evaluate(self, tree):
+        """
+        Return the expected (Attacker score, Defender score) of a game
+        between the given Attacker ExprTree and the saritas defender.
+        """
+        key = tree.canonical_hash()
+        scores = self.cache.get(key)
+        if (scores is None):
+            scores = self.solve(tree)
+            self.cache.put(key, scores)
+        return scores
+
+
+    def omega_cap(self, tree):
+        """
+        Return the omega past which every value plays the same for this tree:
+        beyond every constant it compares AO with, beyond any T or AR it can
+        compare AO with, and beyond where the attacker's behavior stops
+        depending on omega.
+        """
+        cap = max(int(math.ceil(self.params.time_limit)), len(self.params.omega_decay))
+        to_visit = [tree.root]
+        while (len(to_visit) > 0):
+            node = to_visit.pop()
+            if (node.left_child is not None):
+                if ((node.expr.name == 'AO') and (node.expr.comp_name == 'constant')):
+                    cap = max(cap, int(math.ceil(node.expr.constant)))
+                to_visit.append(node.left_child)
+                to_visit.append(node.right_child)
+        return cap + 1
+
+
+    @staticmethod
+    def time_thresholds(tree):
+        """
+        Return what the tree compares T with: a list of the constants, and
+        whether it compares T with AO and with AR.
+        """
+        constants = []
+        with_omega = False
+        with_reward = False
+        to_visit = [tree.root]
+        while (len(to_visit) > 0):
+            node = to_visit.pop()
+            if (node.left_child is not None):
+                names = (node.expr.name, node.expr.comp_name)
+                if ('T' in names):
+                    if ('constant' in names):
+                        constants.append(node.expr.constant)
+                    with_omega |= ('AO' in names)
+                    with_reward |= ('AR' in names)
+                to_visit.append(node.left_child)
+                to_visit.append(node.right_child)
+        return constants, with_omega, with_reward
+
+
+    def attack_block_probs(self, omega):
+        """
+        Return the chance that an attack gets blocked for each of an array of
+        omega values.
+        """
+        if (omega.max() >= len(self.attack_block)):
+            params = self.params
+            values = np.arange(max(omega.max() + 1, 2 * len(self.attack_block)))
+            # (beta_u + sigma_u * z) * scale > c_r  <=>  beta_u + sigma_u * z > c_r / scale
+            scale = 1 + np.exp(-params.gamma * values)
+            self.attack_block = norm.sf(params.c_r / scale, params.beta_u, params.sigma_u)
+        return self.attack_block[omega]
+
+
+    @staticmethod
+    def decide_moves(tree, t, state, omega, reward):
+        """
+        Return an array of the tree's move code for each entry at time step t.
+        """
+        precalcs = {'T': np.full(len(state), t), 'B': state, 'AO': omega, 'AR': reward}
+        moves = np.zeros(len(state), dtype=np.int8)
+        tree.root.calc_batch(precalcs, np.arange(len(state)), moves, GameState.ACTION_CODES)
+        return moves
+
+
+    @staticmethod
+    def combine(pieces):
+        """
+        Given a list of (state, omega, reward, probs, traffic) arrays of
+        entries, return the same with the entries for the same (state,
+        omega, reward) added together and the ones that no longer matter
+        dropped, or None if none are left.
+        """
+        state, omega, reward, probs, traffic = (np.concatenate(part) for part in zip(*pieces))
+        keep = (probs >= ExactEvaluator.TOLERANCE)
+        if (not keep.any()):
+            return None
+        state, omega, reward, probs, traffic = \
+            state[keep], omega[keep], reward[keep], probs[keep], traffic[keep]
+
+        # Number each (state, omega, reward) within the range in play
+        omega_lo = omega.min()
+        reward_lo = reward.min()
+        num_rewards = reward.max() - reward_lo + 1
+        key = ((omega - omega_lo) * num_rewards + (reward - reward_lo)) * 2 + state
+        num_keys = 2 * (omega.max() - omega_lo + 1) * num_rewards
+        if (num_keys <= 4 * len(key)):
+            # (few enough possible keys to count them all directly)
+            probs = np.bincount(key, probs, num_keys)
+            traffic = np.bincount(key, traffic, num_keys)
+            keys = np.flatnonzero(probs)
+            probs = probs[keys]
+            traffic = traffic[keys]
+        else:
+            keys, index = np.unique(key, return_inverse = True)
+            probs = np.bincount(index, probs)
+            traffic = np.bincount(index, traffic)
+        return (keys % 2, omega_lo + (keys // 2) // num_rewards,
+                reward_lo + (keys // 2) % num_rewards, probs, traffic)
+
+
+    def quiet_turns(self, tree, t, last, state, omega, reward, probs, traffic):
+        """
+        Play turns t through last of a stretch in which no game that's
+        unblocked (or could become unblocked) listens or attacks, so omega
+        and reward stand still and each (omega, reward) only moves between
+        blocked and unblocked or ends. Return the entries at the end of it
+        along with the Attacker and Defender scores of the games that ended.
+        """
+        params = self.params
+        UNBLOCKED = GameState.UNBLOCKED
+        BLOCKED = GameState.BLOCKED
+        user_block = self.user_block
+        user_block_traffic = self.user_block_traffic
+
+        # Probability and A_u of each (omega, reward) by state
+        key = omega * (reward.max() + 1) + reward
+        keys, first, index = np.unique(key, return_index = True, return_inverse = True)
+        omega = omega[first]
+        reward = reward[first]
+        num = len(keys)
+        blocked = (state == BLOCKED)
+        p_unblocked = np.bincount(index, probs * ~blocked, num)
+        p_blocked = np.bincount(index, probs * blocked, num)
+        a_unblocked = np.bincount(index, traffic * ~blocked, num)
+        a_blocked = np.bincount(index, traffic * blocked, num)
+
+        # Chance a blocked game ends each turn, given its move
+        moves = ExactEvaluator.decide_moves(tree, t, np.full(num, BLOCKED), omega, reward)
+        end = np.zeros(num)
+        end[moves == ExactEvaluator.LISTEN] = params.delta_l
+        end[moves == ExactEvaluator.ATTACK] = 1.0 if (params.IDLess) else params.delta_a
+        stay = (1 - end) * params.q
+        leave = (1 - end) * (1 - params.q)
+
+        attacker_score = 0.0
+        defender_score = 0.0
+        for turn in range(t, last + 1):
+            ended = (p_blocked * end * reward).sum()
+            ended_traffic = (a_blocked * end).sum()
+            attacker_score += ended * params.attacker_discount(turn)
+            defender_score += (params.user_bonus * ended_traffic
+                               - params.attacker_penalty * ended) / turn
+            # (unblocked games pick up the turn's user traffic)
+            a_unblocked, a_blocked = (a_unblocked * (1 - user_block) + a_blocked * leave
+                                      + p_unblocked * (params.lambda_u - user_block_traffic),
+                                      a_unblocked * user_block + a_blocked * stay
+                                      + p_unblocked * user_block_traffic)
+            p_unblocked, p_blocked = (p_unblocked * (1 - user_block) + p_blocked * leave,
+                                      p_unblocked * user_block + p_blocked * stay)
+
+        entries = ExactEvaluator.combine([(np.full(num, UNBLOCKED), omega, reward,
+                                           p_unblocked, a_unblocked),
+                                          (np.full(num, BLOCKED), omega, reward,
+                                           p_blocked, a_blocked)])
+        return entries, attacker_score, defender_score
+
+
+    def solve(self, tree):
+        """
+        Step the game's distribution forward turn by turn and return the
+        expected (Attacker score, Defender score).
+        """
+        params = self.params
+        UNBLOCKED = GameState.UNBLOCKED
+        BLOCKED = GameState.BLOCKED
+        lambda_u = params.lambda_u
+        user_block = self.user_block
+        user_block_traffic = self.user_block_traffic
+
+        # A passive attacker's game ends after the first turn
+        time_limit = 1 if (tree.is_passive()) else int(math.ceil(params.time_limit))
+        omega_cap = self.omega_cap(tree)
+        constants, with_omega, with_reward = ExactEvaluator.time_thresholds(tree)
+
+        # The games still going: for each (state, omega, reward) they can be
+        # in at the start of a turn, the probability of being there and the
+        # expected A_u over the same event
+        entries = (np.array([UNBLOCKED]), np.array([0]), np.array([0]),
+                   np.array([1.0]), np.array([0.0]))
+
+        attacker_score = 0.0
+        defender_score = 0.0
+
+        t = 0
+        while ((t < time_limit) and (entries is not None)):
+            t += 1
+            state, omega, reward, probs, traffic = entries
+            moves = ExactEvaluator.decide_moves(tree, t, state, omega, reward)
+            unblocked = (state == UNBLOCKED)
+
+            # If no game that's unblocked, or could become unblocked, listens
+            # or attacks, play turns in bulk for as long as that holds: until
+            # T might reach something the tree compares it with (leaving the
+            # last turn for the general case)
+            if ((not (moves[unblocked] != ExactEvaluator.WAIT).any())
+                and (not (ExactEvaluator.decide_moves(tree, t, np.full(len(state), UNBLOCKED),
+                                                      omega, reward) != ExactEvaluator.WAIT).any())):
+                thresholds = [value for value in constants if (value >= t)]
+                if (with_omega and (omega >= t).any()):
+                    thresholds.append(omega[omega >= t].min())
+                if (with_reward and (reward >= t).any()):
+                    thresholds.append(reward[reward >= t].min())
+                last = min([math.ceil(value) - 1 for value in thresholds] + [time_limit - 1])
+                if (last >= t):
+                    entries, attacker_part, defender_part = \
+                        self.quiet_turns(tree, t, last, state, omega, reward, probs, traffic)
+                    attacker_score += attacker_part
+                    defender_score += defender_part
+                    t = last
+                    continue
+
+            # Where the games go this turn, and the games ending this turn
+            pieces = []
+            ended = 0.0
+            ended_traffic = 0.0
+
+            # Unblocked: the user generates traffic, and the defender blocks
+            # if the behavior it sees is over the cut-off
+
+            # wait
+            on = unblocked & (moves == ExactEvaluator.WAIT)
+            if (on.any()):
+                w, r, p, a = omega[on], reward[on], probs[on], traffic[on]
+                pieces.append((np.full(len(p), BLOCKED), w, r, p * user_block,
+                               a * user_block + p * user_block_traffic))
+                pieces.append((np.full(len(p), UNBLOCKED), w, r, p * (1 - user_block),
+                               a * (1 - user_block) + p * (lambda_u - user_block_traffic)))
+
+            # attack: the attacker's behavior is what the defender sees
+            on = unblocked & (moves == ExactEvaluator.ATTACK)
+            if (on.any()):
+                w, r, p, a = omega[on], reward[on], probs[on], traffic[on]
+                a = a + p * lambda_u
+                blocked = self.attack_block_probs(w)
+                if (not params.IDLess):
+                    ended += (p * r).sum() * params.delta_a
+                    ended_traffic += a.sum() * params.delta_a
+                    p = p * (1 - params.delta_a)
+                    a = a * (1 - params.delta_a)
+                    pieces.append((np.full(len(p), BLOCKED), w, r, p * blocked, a * blocked))
+                else:
+                    # the defender blocking is what detects the attack
+                    ended += (p * r * blocked).sum()
+                    ended_traffic += (a * blocked).sum()
+                # an attack that isn't caught or blocked pays off
+                pieces.append((np.full(len(p), UNBLOCKED), w, r + 1,
+                               p * (1 - blocked), a * (1 - blocked)))
+
+            # listen: the attacker observes the user's traffic, which may get
+            # the user blocked
+            on = unblocked & (moves == ExactEvaluator.LISTEN)
+            if (on.any()):
+                w, r, p, a = omega[on], reward[on], probs[on], traffic[on]
+                ended += (p * r).sum() * params.delta_l
+                ended_traffic += (a + p * lambda_u).sum() * params.delta_l
+                p = p * (1 - params.delta_l)
+                a = a * (1 - params.delta_l)
+                # one entry per game and amount of traffic
+                w = np.minimum(w[:, None] + self.traffic_amounts, omega_cap).ravel()
+                r = np.repeat(r, len(self.traffic_amounts))
+                a = ((a[:, None] + p[:, None] * self.traffic_amounts) * self.traffic_pmf).ravel()
+                p = (p[:, None] * self.traffic_pmf).ravel()
+                block = np.tile(self.traffic_block, len(p) // len(self.traffic_block))
+                pieces.append((np.full(len(p), BLOCKED), w, r, p * block, a * block))
+                pieces.append((np.full(len(p), UNBLOCKED), w, r, p * (1 - block), a * (1 - block)))
+
+            # Blocked: no traffic, the defender blocks, and the game stays
+            # blocked with probability q
+            on = ~unblocked
+            if (on.any()):
+                w, r, p, a, m = omega[on], reward[on], probs[on], traffic[on], moves[on]
+                end = np.zeros(len(p))
+                end[m == ExactEvaluator.LISTEN] = params.delta_l
+                end[m == ExactEvaluator.ATTACK] = 1.0 if (params.IDLess) else params.delta_a
+                ended += (p * r * end).sum()
+                ended_traffic += (a * end).sum()
+                p = p * (1 - end)
+                a = a * (1 - end)
+                pieces.append((np.full(len(p), BLOCKED), w, r, p * params.q, a * params.q))
+                pieces.append((np.full(len(p), UNBLOCKED), w, r,
+                               p * (1 - params.q), a * (1 - params.q)))
+
+            entries = ExactEvaluator.combine(pieces)
+
+            # Every game still going ends at the time limit
+            if ((t == time_limit) and (entries is not None)):
+                ended += (entries[3] * entries[2]).sum()
+                ended_traffic += entries[4].sum()
+
+            attacker_score += ended * params.attacker_discount(t)
+            defender_score += (params.user_bonus * ended_traffic
+                               - params.attacker_penalty * ended) / t
+
+        return attacker_score, defender_score
@@ -5,8 +5,13 @@ import random
 import time
 import traceback
 import ast
+import io
+import numpy
+from concurrent.futures import ProcessPoolExecutor
 
 from ccegpStrategy import CCEGPStrategy
+from gameParams import GameParams
+from gameState import WorldTrace
 
 
 class Experiment:
@@ -14,6 +19,9 @@ class Experiment:
     Provide capabilities to run an experiment within given
     configuration parameters.
     """
+    # The strategy a run worker process executes runs with, set by
+    # start_run_worker
+    worker_strategy = None
 
     def __init__(self, config_file_path):
         """
@@ -23,8 +31,16 @@ class Experiment:
         self.config_parser = None
 
         self.random_seed = None
+        # Root of the numpy SeedSequence tree the games' random numbers come
+        # from (experiment -> run -> generation -> game), and the current run's
+        # node in it
+        self.seed_sequence = None
+        self.run_seed_sequence = None
         self.strategy = 'ccegp'
         self.num_runs_per_experiment = 1
+        # How many worker processes play the runs at once (0 = one after
+        # another in this process)
+        self.run_workers = 0
         self.num_fitness_evals_per_run = 100
         self.log_file_path = 'logs/defaultLog.txt'
         self.log_file = None
@@ -35,7 +51,10 @@ class Experiment:
         self.defender_solution_dot_path = 'solutions/defaultDefenderSolution.dot'
         self.defender_solution_png_path = 'solutions/defaultDefenderSolution.png'
         self.high_score_world_file_path = 'worlds/defaultWorld.txt'
-        self.world_data = None  # Array of strings that will be written to world data file
+        self.world_data = None  # WorldTrace whose lines will be written to world data file
+        # How much of each game to record during evolution (off, compact, or full);
+        # the exhibition game whose world is written out is always recorded in full
+        self.trace_level = 'off'
 
         self.render_solutions = False
         self.print_dots = False
@@ -73,6 +92,13 @@ class Experiment:
         self.user_bonus = 1
         self.attacker_penalty = 1
         self.IDLess = False
+        # Turns of per-turn history kept by each game (0 = the whole game)
+        self.history_length = 0
+        # Skip over stretches of turns whose outcome is already settled?
+        self.fast_forward = False
+
+        # Game parameters shared by every game, built once they're parsed
+        self.game_params = None
 
         try:
             self.config_parser = configparser.ConfigParser()
@@ -85,6 +111,8 @@ class Experiment:
                 print('config: random_seed not specified; using system time')
                 self.random_seed = int(time.time() * 1000.0)
             random.seed(self.random_seed)
+            # (random.seed uses the seed's absolute value too)
+            self.seed_sequence = numpy.random.SeedSequence(abs(self.random_seed))
 
             try:
                 self.strategy = self.config_parser.get('basic_options', 'strategy')
@@ -98,6 +126,12 @@ class Experiment:
             except:
                 print('config: num_runs_per_experiment not properly specified; using', self.num_runs_per_experiment)
 
+            try:
+                self.run_workers = self.config_parser.getint('basic_options', 'run_workers')
+                print('config: run_workers =', self.run_workers)
+            except:
+                print('config: run_workers not properly specified; using', self.run_workers)
+
             try:
                 self.num_fitness_evals_per_run = self.config_parser.getint('basic_options',
                                                                            'num_fitness_evals_per_run')
@@ -178,6 +212,15 @@ class Experiment:
             except:
                 print('config: defender_open_png not properly specified; using', self.defender_open_png)
 
+            try:
+                self.trace_level = self.config_parser.get('basic_options', 'trace_level').lower()
+                print('config: trace_level =', self.trace_level)
+            except:
+                print('config: trace_level not properly specified; using', self.trace_level)
+            if (self.trace_level not in WorldTrace.LEVELS):
+                print('config: unknown trace_level', self.trace_level, '; using off')
+                self.trace_level = 'off'
+
             # Parse gamestate config properties
             try:
                 self.defender_strategy = self.config_parser.get('game_options', 'defender_strategy')
@@ -275,6 +318,20 @@ class Experiment:
             except:
                 print('config: IDLess not specified; using', self.IDLess)
 
+            try:
+                self.history_length = self.config_parser.getint('game_options', 'history_length')
+                print('config: history_length =', self.history_length)
+            except:
+                print('config: history_length not specified; using', self.history_length)
+
+            try:
+                self.fast_forward = self.config_parser.getboolean('game_options', 'fast_forward')
+                print('config: fast_forward =', self.fast_forward)
+            except:
+                print('config: fast_forward not specified; using', self.fast_forward)
+
+            self.game_params = GameParams(self)
+
             # Dump parms to log file
             try:
                 self.log_file = open(self.log_file_path, 'w')
@@ -284,6 +341,7 @@ class Experiment:
                 self.log_file.write('strategy: ' + self.strategy + '\n')
                 self.log_file.write('number of runs per experiment: '
                                     + str(self.num_runs_per_experiment) + '\n')
+                self.log_file.write('run workers: ' + str(self.run_workers) + '\n')
                 self.log_file.write('number of fitness evals per run: '
                                     + str(self.num_fitness_evals_per_run) + '\n')
                 self.log_file.write('attacker solution file path: '
@@ -300,6 +358,7 @@ class Experiment:
                                     + self.defender_solution_png_path + '\n')
                 self.log_file.write('high score world file path: '
                                     + self.high_score_world_file_path + '\n')
+                self.log_file.write('trace level: ' + self.trace_level + '\n')
                 self.log_file.write('defender_strategy: ' + self.defender_strategy + '\n')
                 self.log_file.write('game_time_limit: ' + str(self.game_time_limit) + '\n')
                 self.log_file.write('ca_classifiers: ' + str(self.ca_classifiers) + '\n')
@@ -317,6 +376,8 @@ class Experiment:
                 self.log_file.write('attacker_penalty: ' \
                                     + str(self.attacker_penalty) + '\n')
                 self.log_file.write('IDLess: ' + str(self.IDLess) + '\n')
+                self.log_file.write('history_length: ' + str(self.history_length) + '\n')
+                self.log_file.write('fast_forward: ' + str(self.fast_forward) + '\n')
 
             except:
                 print('config: problem with log file', self.log_file_path)
@@ -328,10 +389,13 @@ class Experiment:
             return None
 
 
-    def run_experiment(self):
+    def run_experiment(self, runs = None):
         """
         Run the experiment defined by the member variables contained in this
         experiment instance on the provided puzzle state.
+
+        If runs is given, execute only those runs (numbered from 1), each the
+        same as it would be in the whole experiment.
         """
 
         start_time = time.time()
@@ -343,44 +407,32 @@ class Experiment:
             print('strategy unknown:', self.strategy)
             sys.exit(1)
 
-        # For each run...
-        for curr_run in range(1, self.num_runs_per_experiment + 1):
-
-            # Update log
-            self.curr_run = curr_run
-            print('\nRun', curr_run)
-            self.log_file.write('\nRun ' + str(curr_run) + '\n')
-
-            # Execute one run and get best values.
-            attacker_run_high_fitness, attacker_run_best_world_data, attacker_run_best_solution, \
-                defender_run_high_fitness, defender_run_best_solution, attacker_dot, defender_dot \
-                = strategy_instance.execute_one_run()
-
-            print('\nBest attacker tree of run:\n' + attacker_run_best_solution)
-            if (self.print_dots):
-                print('\nBest attacker dot of run:\n' + str(attacker_dot))
-            print('\nBest defender tree of run:\n' + defender_run_best_solution)
-            if (self.print_dots):
-                print('\nBest defender dot of run:\n' + str(defender_dot))
-
-            # If best of run is best overall, update appropriate values
-            if (self.strategy != 'ccegp'):
-                if (attacker_run_high_fitness > self.attacker_exp_high_fitness):
-                    self.attacker_exp_high_fitness = attacker_run_high_fitness
-                    print('New exp Attacker high fitness: ', self.attacker_exp_high_fitness)
-                    self.attacker_exp_best_world_data = attacker_run_best_world_data
-                    self.attacker_exp_best_solution = attacker_run_best_solution
-                    self.attacker_exp_best_dot = attacker_dot
-            # If Competitive Co-evolution, add fitnesses (use Attacker to store most data)
-            else:
-                if ((attacker_run_high_fitness + defender_run_high_fitness) > self.attacker_exp_high_fitness):
-                    self.attacker_exp_high_fitness = (attacker_run_high_fitness + defender_run_high_fitness)
-                    print('New exp Attacker+Defender high fitness: ', self.attacker_exp_high_fitness)
-                    self.attacker_exp_best_world_data = attacker_run_best_world_data
-                    self.attacker_exp_best_solution = attacker_run_best_solution
-                    self.defender_exp_best_solution = defender_run_best_solution
-                    self.attacker_exp_best_dot = attacker_dot
-                    self.defender_exp_best_dot = defender_dot
+        # Each run's random numbers come from its own child of the experiment's
+        # seed sequence
+        run_seed_sequences = self.seed_sequence.spawn(self.num_runs_per_experiment)
+        if (runs is None):
+            runs = range(1, self.num_runs_per_experiment + 1)
+
+        if (self.run_workers > 0):
+            # Play the runs in worker processes, each writing its logs to
+            # buffers, then add the buffers to the logs in run order. (Flush
+            # first, so workers started by forking don't inherit unwritten
+            # output.)
+            self.log_file.flush()
+            strategy_instance.parsimony_log.flush()
+            with ProcessPoolExecutor(max_workers = self.run_workers,
+                                     initializer = Experiment.start_run_worker,
+                                     initargs = (strategy_instance,)) as executor:
+                for log_text, parsimony_text, results in executor.map(
+                        Experiment.execute_run_in_worker, runs,
+                        [run_seed_sequences[curr_run - 1] for curr_run in runs]):
+                    self.log_file.write(log_text)
+                    strategy_instance.parsimony_log.write(parsimony_text)
+                    self.record_run(*results)
+        else:
+            for curr_run in runs:
+                self.record_run(*self.execute_run(strategy_instance, curr_run,
+                                                  run_seed_sequences[curr_run - 1]))
 
         # Dump best world to file
         the_file = open(self.high_score_world_file_path, 'w')
@@ -427,3 +479,93 @@ class Experiment:
             self.log_file.close()
 
         print(time.time() - start_time, 'seconds')
+
+
+    def __getstate__(self):
+        # The log file stays with the process that opened it; run workers
+        # write to buffers of their own
+        state = self.__dict__.copy()
+        state['log_file'] = None
+        return state
+
+
+    def execute_run(self, strategy_instance, curr_run, run_seed_sequence):
+        """
+        Execute run curr_run of the experiment with the given strategy, taking
+        its random numbers from run_seed_sequence, and return the run's best
+        values as returned by the strategy's execute_one_run.
+
+        Python's random module is seeded from the run's seed sequence too, so
+        a run comes out the same however many runs come before it and
+        wherever it's executed.
+        """
+        # Update log
+        self.curr_run = curr_run
+        self.run_seed_sequence = run_seed_sequence
+        random.seed(int(run_seed_sequence.generate_state(1, numpy.uint64)[0]))
+        print('\nRun', curr_run)
+        self.log_file.write('\nRun ' + str(curr_run) + '\n')
+        self.log_file.write('run seed spawn key: '
+                            + str(self.run_seed_sequence.spawn_key) + '\n')
+
+        # Execute one run and get best values.
+        return strategy_instance.execute_one_run()
+
+
+    @staticmethod
+    def start_run_worker(strategy_instance):
+        """
+        Set up a run worker process to execute runs with the given strategy
+        (and its experiment).
+        """
+        Experiment.worker_strategy = strategy_instance
+
+
+    @staticmethod
+    def execute_run_in_worker(curr_run, run_seed_sequence):
+        """
+        Execute a run in a run worker process (see execute_run) and return
+        what it wrote to the experiment log and the parsimony log, along with
+        its best values.
+        """
+        strategy_instance = Experiment.worker_strategy
+        experiment = strategy_instance.experiment
+        experiment.log_file = io.StringIO()
+        strategy_instance.parsimony_log = io.StringIO()
+        results = experiment.execute_run(strategy_instance, curr_run, run_seed_sequence)
+        return experiment.log_file.getvalue(), strategy_instance.parsimony_log.getvalue(), results
+
+
+    def record_run(self, attacker_run_high_fitness, attacker_run_best_world_data,
+                   attacker_run_best_solution, defender_run_high_fitness,
+                   defender_run_best_solution, attacker_dot, defender_dot):
+        """
+        Report a run's best values (as returned by the strategy's
+        execute_one_run) and keep them if they're the best of the experiment
+        so far.
+        """
+        print('\nBest attacker tree of run:\n' + attacker_run_best_solution)
+        if (self.print_dots):
+            print('\nBest attacker dot of run:\n' + str(attacker_dot))
+        print('\nBest defender tree of run:\n' + defender_run_best_solution)
+        if (self.print_dots):
+            print('\nBest defender dot of run:\n' + str(defender_dot))
+
+        # If best of run is best overall, update appropriate values
+        if (self.strategy != 'ccegp'):
+            if (attacker_run_high_fitness > self.attacker_exp_high_fitness):
+                self.attacker_exp_high_fitness = attacker_run_high_fitness
+                print('New exp Attacker high fitness: ', self.attacker_exp_high_fitness)
+                self.attacker_exp_best_world_data = attacker_run_best_world_data
+                self.attacker_exp_best_solution = attacker_run_best_solution
+                self.attacker_exp_best_dot = attacker_dot
+        # If Competitive Co-evolution, add fitnesses (use Attacker to store most data)
+        else:
+            if ((attacker_run_high_fitness + defender_run_high_fitness) > self.attacker_exp_high_fitness):
+                self.attacker_exp_high_fitness = (attacker_run_high_fitness + defender_run_high_fitness)
+                print('New exp Attacker+Defender high fitness: ', self.attacker_exp_high_fitness)
+                self.attacker_exp_best_world_data = attacker_run_best_world_data
+                self.attacker_exp_best_solution = attacker_run_best_solution
+                self.defender_exp_best_solution = defender_run_best_solution
+                self.attacker_exp_best_dot = attacker_dot
+                self.defender_exp_best_dot = defender_dot
@@ -1,23 +1,247 @@
 # -*- coding: utf-8 -*-
 import sys
+import math
 import random
+import hashlib
+import weakref
+import numpy
 from graphviz import Digraph
 
 class ExprTree():
     """
     Defines an Expression Tree -- this is the encoding of an individual.
     """
+    # Compiled decision functions by source, shared by all trees that
+    # compile to the same source (cleared when it gets this big)
+    compiled_cache = {}
+    COMPILED_CACHE_SIZE = 10000
+    # Decision regions are worked out by walking the tree until it has been
+    # asked for this many, after which compiling its region function pays off
+    REGION_COMPILE_AFTER = 1000
+
+    __slots__ = ('root', 'fitness', 'score', 'compiled', 'summary', 'compiled_regions',
+                 'region_calls', 'digest', 'bfs_index', 'bfs_parents')
+
     def __init__(self, root):
         self.root = root
         self.fitness = -1  # fitness may be modified by parsimony pressure
         self.score = -1
-        self.world_data = []  # the world data that produced the fitness
+        self.compiled = None  # the tree compiled to a function, once it's used
+        self.summary = None  # the tree's TreeSummary, once it's asked for
+        self.compiled_regions = {}  # region functions compiled so far, by monotone inputs
+        self.region_calls = 0  # regions worked out without a compiled function
+        self.digest = None  # the tree's canonical hash, once it's asked for
+        self.bfs_index = None  # the tree's nodes in breadth-first order, once needed
+        self.bfs_parents = None  # the position in bfs_index of each node's parent
+
+    def __getstate__(self):
+        # Compiled functions can't be pickled (or usefully deep-copied); a
+        # copy compiles itself again, usually straight from the cache
+        state = {name: getattr(self, name) for name in ExprTree.__slots__}
+        state['compiled'] = None
+        state['compiled_regions'] = {}
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def calc(self, precalcs):
+        """
+        Return the terminal value the tree decides on given the precalculated
+        function values, the same as root.calc but through the tree compiled
+        to a Python function (compiled on first use).
+        """
+        if (self.compiled is None):
+            self.compiled = self.compile()
+        return self.compiled(precalcs)
+
+    def region(self, precalcs, monotone = ()):
+        """
+        Return the terminal value the tree decides on along with its decision
+        region around precalcs, the same as root.region; once the tree has
+        been asked often enough, through a function compiled for the given
+        monotone inputs.
+        """
+        compiled = self.compiled_regions.get(monotone)
+        if (compiled is not None):
+            return compiled(precalcs)
+        self.region_calls += 1
+        if (self.region_calls >= ExprTree.REGION_COMPILE_AFTER):
+            self.compiled_regions[monotone] = self.compile_region(monotone)
+        return self.root.region(precalcs, monotone)
+
+    def invalidate(self):
+        """
+        Drop the compiled functions, summary, canonical hash and node index;
+        to be called whenever the tree changes.
+        """
+        self.compiled = None
+        self.compiled_regions = {}
+        self.region_calls = 0
+        self.summary = None
+        self.digest = None
+        self.bfs_index = None
+        self.bfs_parents = None
+
+    def summarize(self):
+        """
+        Return the tree's TreeSummary (worked out on first use).
+        """
+        if (self.summary is None):
+            self.summary = TreeSummary(self.root)
+        return self.summary
+
+    def nth_node(self, n):
+        """
+        Return the nth node of the tree in breadth-first order (counting from
+        1), from an index of the nodes (see Node.breadth_first) built on
+        first use, so picking many nodes costs one traversal.
+        """
+        if (self.bfs_index is None):
+            self.bfs_index, self.bfs_parents = self.root.breadth_first()
+        # Sanity check
+        if (n > len(self.bfs_index)):
+            print("nth_node error: n > size:", n)
+            sys.exit(1)
+        return self.bfs_index[n - 1]
+
+    def nth_depth(self, n):
+        """
+        Return the depth of the nth node (see nth_node).
+        """
+        self.nth_node(n)
+        depth = 0
+        position = n - 1
+        while (position > 0):
+            position = self.bfs_parents[position]
+            depth += 1
+        return depth
+
+    def copy(self):
+        """
+        Return a copy of the tree, fitness and score included, that shares its
+        nodes with this one. Nodes never change once a tree is in a
+        population (variation goes through copy_path), so sharing them is as
+        good as copying them.
+        """
+        tree = ExprTree(self.root)
+        tree.fitness = self.fitness
+        tree.score = self.score
+        tree.compiled = self.compiled
+        tree.summary = self.summary
+        tree.digest = self.digest
+        tree.bfs_index = self.bfs_index
+        tree.bfs_parents = self.bfs_parents
+        return tree
+
+    def copy_path(self, n):
+        """
+        Return a new tree that can be changed at its nth node (see nth_node)
+        without changing this one, along with the path from its root down to
+        that node. Only the nodes on the path are copied; every other subtree
+        is shared with this tree, so changes must be made to the path's nodes
+        (e.g. by build_tree or swap at the last one) and then finished with
+        clean_changed.
+        """
+        self.nth_node(n)
+        positions = [n - 1]
+        while (positions[-1] > 0):
+            positions.append(self.bfs_parents[positions[-1]])
+        positions.reverse()
+
+        # A subtree can turn up more than once in a tree, so which child is
+        # on the path goes by position: a left child is listed right before
+        # its sibling
+        path = []
+        for position in positions:
+            copied = Node()
+            copied.copy(self.bfs_index[position])
+            if (len(path) > 0):
+                if ((position + 1 < len(self.bfs_parents))
+                    and (self.bfs_parents[position + 1] == self.bfs_parents[position])):
+                    path[-1].left_child = copied
+                else:
+                    path[-1].right_child = copied
+            path.append(copied)
+        return ExprTree(path[0]), path
+
+    def intern(self):
+        """
+        Share the tree's subtrees with identical ones in other trees (see
+        Node.intern); to be called once the tree is finished, as its nodes
+        mustn't change after.
+        """
+        self.root = self.root.intern()
+        self.bfs_index = None
+        self.bfs_parents = None
+
+    def canonical_hash(self):
+        """
+        Return the canonical hash of the tree's structure (worked out on first
+        use). Trees with the same hash decide the same on every input.
+        """
+        if (self.digest is None):
+            self.digest = self.root.canonical_hash()
+        return self.digest
+
+    def compile(self):
+        """
+        Return the tree compiled to a function of the precalcs dict: the
+        inputs the tree reads are loaded into local variables, followed by
+        the tree as nested if statements that return its terminals.
+        """
+        lines = []
+        names = set()
+        self.root.source(lines, names, 1)
+        source = ('def calc(precalcs):\n'
+                  + ''.join('    ' + name + ' = precalcs[' + repr(name) + ']\n'
+                            for name in sorted(names))
+                  + '\n'.join(lines) + '\n')
+        return ExprTree.load(source, 'calc')
+
+    def compile_region(self, monotone):
+        """
+        Return the tree's region method compiled to a function of the precalcs
+        dict, for the given monotone inputs: after loading the inputs the tree
+        reads, each gets a low and a high bound, which the nested if
+        statements narrow on the way down before returning the terminal along
+        with the bounds.
+        """
+        names = sorted(self.summarize().features)
+        bounds = '{' + ', '.join(repr(name) + ': (' + name + '_low, ' + name + '_high)'
+                                 for name in names) + '}'
+        lines = []
+        self.root.region_source(lines, 1, monotone, bounds)
+        source = ('def region(precalcs):\n'
+                  + ''.join('    ' + name + ' = precalcs[' + repr(name) + ']\n'
+                            + '    ' + name + '_low, ' + name + '_high = -inf, inf\n'
+                            for name in names)
+                  + '\n'.join(lines) + '\n')
+        return ExprTree.load(source, 'region')
+
+    @staticmethod
+    def load(source, name):
+        """
+        Return the function called name that the given source defines, from
+        the cache if it's been compiled before.
+        """
+        compiled = ExprTree.compiled_cache.get(source)
+        if (compiled is None):
+            namespace = {'inf': math.inf, 'nextafter': numpy.nextafter}
+            exec(compile(source, '<ExprTree>', 'exec'), namespace)
+            compiled = namespace[name]
+            if (len(ExprTree.compiled_cache) >= ExprTree.COMPILED_CACHE_SIZE):
+                ExprTree.compiled_cache.clear()
+            ExprTree.compiled_cache[source] = compiled
+        return compiled
 
     def build_tree(self, pop, node, depth, dmax, grow_or_full):
         """
         Recursively build an expression tree to the given depth using either
         the 'grow' or 'full' method.
         """
+        self.invalidate()
         expr_parms = None
         # Randomly choose a new expression. If not at depth limit,
         # choose an inner node from a set that depends on method 'grow' or 'full'
@@ -34,8 +258,7 @@ class ExprTree():
             expr_parms = random.choice(pop.terminals)
 
         # Make a new tree node with this info
-        node.expr = DTExpr(expr_parms)
-        node.depth = depth
+        node.expr = DTExpr(expr_parms).intern()
 
         # If this node is not a terminal, make its children and update
         # height and count of this node.
@@ -44,6 +267,7 @@ class ExprTree():
             self.build_tree(pop, node.left_child, depth + 1, dmax, grow_or_full)
             node.right_child = Node()
             self.build_tree(pop, node.right_child, depth + 1, dmax, grow_or_full)
+            node.update_metrics()
         
         return node
 
@@ -54,10 +278,45 @@ class ExprTree():
         mutation so that mutations are more meaningful.
         """
         self.root = self._clean_tree_recurse(self.root)
+        self.invalidate()
         # is one reset better here than incremental resets as we collapse the tree?
         #self.root.reset_metrics()
         # actually it appears that resetting metrics is delegated to the caller
         
+    def clean_changed(self, path):
+        """
+        Clean the tree and update its metrics after the subtree at the end of
+        path (as returned by copy_path) was rebuilt or swapped, given that the
+        rest of the tree was already clean and its metrics up to date. Only
+        the subtree and the path to it are touched, so the cost grows with the
+        size of the change rather than the size of the tree; the result is the
+        same as clean_tree followed by root.reset_metrics.
+        """
+        self.invalidate()
+        node = self._clean_tree_recurse(path[-1])
+
+        # Put the cleaned subtree in place; if that leaves its parent with two
+        # identical terminals, the parent collapses too, and so on up
+        depth = len(path) - 1
+        while (depth > 0):
+            parent = path[depth - 1]
+            if (parent.left_child is path[depth]):
+                parent.left_child = node
+            else:
+                parent.right_child = node
+            if (not ((parent.left_child.left_child is None)
+                     and (parent.right_child.left_child is None)
+                     and (parent.left_child.expr.name == parent.right_child.expr.name))):
+                break
+            node = parent.left_child
+            depth -= 1
+        if (depth == 0):
+            self.root = node
+
+        # Then bring sizes and heights up to date on the way to the root
+        for parent in reversed(path[:depth]):
+            parent.update_metrics()
+
     def _clean_tree_recurse(self, node):
         """
         recurse on the node and collapse redundant branches
@@ -65,9 +324,17 @@ class ExprTree():
         # If this is a terminal node return it
         if (node.left_child is None):
             return node
-        # else clean the left and right subtrees
-        node.left_child = self._clean_tree_recurse(node.left_child)
-        node.right_child = self._clean_tree_recurse(node.right_child)
+        # else clean the left and right subtrees. Subtrees that are already
+        # clean come back as they were (same size, as cleaning only ever
+        # removes nodes) and are left alone, since they may be shared with
+        # other trees.
+        left_child = self._clean_tree_recurse(node.left_child)
+        right_child = self._clean_tree_recurse(node.right_child)
+        if ((left_child is not node.left_child) or (right_child is not node.right_child)
+            or (node.size != 1 + left_child.size + right_child.size)):
+            node.left_child = left_child
+            node.right_child = right_child
+            node.update_metrics()
         # if both left and right subtrees are terminal, and their actions are the same,
         # then compress this subtree into that action by returning the terminal node
         if ((node.left_child.left_child is None and node.right_child.left_child is None) and
@@ -78,6 +345,56 @@ class ExprTree():
         # else we can't colapse this node so return the full tree
         return node
     
+    def simplify(self):
+        """
+        Simplify the tree without changing what it decides. Going down each
+        path, keep track of what the tests passed so far say about the inputs
+        (an interval for each real input compared against constants, and the
+        outcome of each boolean and input-to-input comparison); replace any
+        test whose outcome is already settled by the branch it takes, and any
+        terminal that mutation has left with children by its right branch,
+        which is the one calc takes. Then clean the tree. Nodes are copied
+        rather than changed, since they may be shared with other trees.
+        """
+        self.root = self._simplify_recurse(self.root, {}, {})
+        self.clean_tree()
+
+    def _simplify_recurse(self, node, intervals, outcomes):
+        """
+        recurse on the node given what the path to it says about the inputs:
+        intervals maps real inputs to (low, high) with low <= input < high,
+        and outcomes maps comparisons (see DTExpr.outcome) to their results
+        """
+        while (node.left_child is not None):
+            if (node.expr.datatype == 'terminal'):
+                node = node.right_child
+                continue
+            value = node.expr.outcome(intervals, outcomes)
+            if (value is None):
+                break
+            node = node.left_child if (value != node.expr.invert) else node.right_child
+
+        # If this is a terminal node return it
+        if (node.left_child is None):
+            return node
+
+        # else simplify each branch knowing which way this test went
+        if (node.expr.invert):
+            when_true, when_false = 'right_child', 'left_child'
+        else:
+            when_true, when_false = 'left_child', 'right_child'
+        branches = {}
+        for attr, value in ((when_true, True), (when_false, False)):
+            branch_intervals, branch_outcomes = node.expr.assume(intervals, outcomes, value)
+            branches[attr] = self._simplify_recurse(getattr(node, attr),
+                                                    branch_intervals, branch_outcomes)
+        if ((branches['left_child'] is node.left_child)
+            and (branches['right_child'] is node.right_child)):
+            return node
+        simplified = Node(node.expr, branches['left_child'], branches['right_child'])
+        simplified.update_metrics()
+        return simplified
+
     def is_passive(self):
         """
         Return True if no terminals evaluate to attack
@@ -85,16 +402,8 @@ class ExprTree():
         or when it has attacker terminals only hidden underneath conditionals that
         will never be true.
         """
-        return self._is_passive_recurse(self.root)
+        return not self.summarize().can_attack
 
-    def _is_passive_recurse(self, node):
-        """
-        I really gotta put these in the Node class...
-        """
-        if (node.left_child is None):
-            return node.expr.name != 'attack'
-        return self._is_passive_recurse(node.left_child) and self._is_passive_recurse(node.right_child)
-        
     def dot_viz(self):
         """
         Return a graphviz DOT object that can be rendered to display
@@ -138,19 +447,28 @@ class Node():
         - 0 children indicates this is a terminal node. It's often checked
           by left_child is None?
     """
+    # Finished trees never change their nodes (variation copies the path it
+    # changes), so identical subtrees are shared by all the trees that have
+    # them through this table, keyed by expression and children
+    interned = weakref.WeakValueDictionary()
+
+    __slots__ = ('expr', 'left_child', 'right_child', 'height', 'size', '__weakref__')
+
     def __init__(self, expr = None,
                  left_child = None, right_child = None):
         self.expr = expr
         self.left_child = left_child
         self.right_child = right_child
-        self.parent = None
-        self.depth = 0
         self.height = 0
         self.size = 1
 
     def calc(self, precalcs):
         """
         Recursive method to determine the value represented by this node.
+
+        A terminal that mutation has left with children gets its name from
+        calc_expr, which is never True, so calc always goes down its right
+        branch. Every other way of evaluating a tree does the same.
         """
         curr_val = self.expr.calc_expr(precalcs)
 
@@ -165,45 +483,198 @@ class Node():
             return self.right_child.calc(precalcs)
 
 
-    def reset_metrics(self, parent = None, depth = 0):
+    def source(self, lines, names, indent):
         """
-        Recursive method to reset depth, height, and size of all nodes.
+        Recursive method to append the lines of Python source that return
+        this subtree's value (as calc would) to lines at the given indent
+        level, adding the names of the inputs it reads to names.
         """
-        self.parent = parent
-        self.depth = depth
-        self.height = 0
-        self.size = 1
+        pad = '    ' * indent
+
+        # If this is a terminal, return its value
+        if (self.left_child is None):
+            lines.append(pad + 'return ' + repr(self.expr.name))
+            return
+
+        # A terminal with children goes right (see calc)
+        if (self.expr.datatype == 'terminal'):
+            self.right_child.source(lines, names, indent)
+            return
+
+        # The left branch returns, so the right one can follow at this level
+        lines.append(pad + 'if ' + self.expr.source(names) + ':')
+        self.left_child.source(lines, names, indent + 1)
+        self.right_child.source(lines, names, indent)
+
+
+    def canonical_hash(self):
+        """
+        Recursive method to return the canonical hash of this subtree: a
+        digest of its expressions (see DTExpr.canonical) and shape in
+        preorder, so subtrees that are built the same hash the same.
+        """
+        internal = (self.left_child is not None)
+        digest = hashlib.blake2b((self.expr.canonical() + ('(' if (internal) else '')).encode(),
+                                 digest_size = 16)
+        if (internal):
+            digest.update(self.left_child.canonical_hash())
+            digest.update(self.right_child.canonical_hash())
+        return digest.digest()
+
+
+    def region(self, precalcs, monotone = ()):
+        """
+        Version of calc that also returns the decision region around precalcs:
+        a dict mapping each input the decision path reads to a closed interval
+        (low, high) such that calc gives the same answer for any inputs that
+        each stay within their interval. Inputs named in monotone are taken to
+        never decrease, which lets a comparison between two of them be bounded
+        by limiting just one.
+        """
+        bounds = {}
+        node = self
+        while (node.left_child is not None):
+            # A terminal with children goes right (see calc)
+            if (node.expr.datatype == 'terminal'):
+                node = node.right_child
+                continue
+            if (node.expr.bound(precalcs, monotone, bounds)):
+                node = node.left_child
+            else:
+                node = node.right_child
+        return node.expr.name, bounds
+
+
+    def region_source(self, lines, indent, monotone, bounds):
+        """
+        Recursive method to append the lines of Python source that return
+        this subtree's value and decision region (as region would) to lines
+        at the given indent level, where bounds is the source of the dict of
+        bounds to return.
+        """
+        pad = '    ' * indent
+
+        # If this is a terminal, return its value and the bounds so far
+        if (self.left_child is None):
+            lines.append(pad + 'return ' + repr(self.expr.name) + ', ' + bounds)
+            return
+
+        # A terminal with children goes right (see calc)
+        if (self.expr.datatype == 'terminal'):
+            self.right_child.region_source(lines, indent, monotone, bounds)
+            return
+
+        # Branch on the comparison before inverting, since that's what the
+        # bounds depend on
+        if (self.expr.invert):
+            when_true, when_false = self.right_child, self.left_child
+        else:
+            when_true, when_false = self.left_child, self.right_child
+        lines.append(pad + 'if ' + self.expr.source(set(), invert = False) + ':')
+        lines.extend(pad + '    ' + line for line in self.expr.bound_source(monotone, True))
+        when_true.region_source(lines, indent + 1, monotone, bounds)
+        lines.append(pad + 'else:')
+        lines.extend(pad + '    ' + line for line in self.expr.bound_source(monotone, False))
+        when_false.region_source(lines, indent + 1, monotone, bounds)
+
+
+    def calc_batch(self, precalcs, rows, out, codes):
+        """
+        Vectorized version of calc. precalcs maps each function name to an
+        array of values (one per game), rows holds the indices of the games
+        to evaluate, and the code of each game's terminal (looked up by name
+        in codes) is written to out at that game's index.
+        """
+        # If this is a terminal, every game that got here gets its value
+        if (self.left_child is None):
+            out[rows] = codes[self.expr.name]
+            return
+
+        # A terminal with children goes right (see calc)
+        if (self.expr.datatype == 'terminal'):
+            self.right_child.calc_batch(precalcs, rows, out, codes)
+            return
 
+        # Split the games between the left and right children
+        curr_vals = self.expr.calc_expr_batch(precalcs, rows)
+        left_rows = rows[curr_vals]
+        if (len(left_rows) > 0):
+            self.left_child.calc_batch(precalcs, left_rows, out, codes)
+        right_rows = rows[~curr_vals]
+        if (len(right_rows) > 0):
+            self.right_child.calc_batch(precalcs, right_rows, out, codes)
+
+
+    def reset_metrics(self):
+        """
+        Recursive method to reset height and size of all nodes.
+        """
         # If not terminal node, recurse.
         if (not (self.left_child is None)):
-            self.left_child.reset_metrics(parent = self, depth = self.depth + 1)
-            self.right_child.reset_metrics(parent = self, depth = self.depth + 1)
+            self.left_child.reset_metrics()
+            self.right_child.reset_metrics()
+        self.update_metrics()
+
+
+    def update_metrics(self):
+        """
+        Set the height and size of this node from its children's. Nodes
+        don't know their depth or parent, which depend on the tree they're
+        in; a node can be shared by several trees.
+        """
+        self.height = 0
+        self.size = 1
+        if (not (self.left_child is None)):
             self.size += (self.left_child.size + self.right_child.size)
             self.height = 1 + max(self.left_child.height, self.right_child.height)
 
 
-    def find_nth_node(self, n, counter = 1):
+    def breadth_first(self):
         """
-        Use breadth-first-search to identify and return the "nth"
-        node of the tree.
+        Return a list of the nodes of this subtree in breadth-first order
+        (a node's breadth-first index, counting from 1, is its place in the
+        list plus one), along with a list of the position in it of each
+        node's parent (None for this node).
         """
-        # Sanity check
-        if (n > self.size):
-            print("find_nth_node error: n > size:", n)
-            sys.exit(1)
-
-        # Visit nodes with BFS, incrementing counter until we find a match
-        to_visit = [self]
-        counter = 0
-        while (len(to_visit) > 0):
-            curr = to_visit.pop(0)
-            counter += 1
-            if (counter == n):
-                return curr
-            # If not terminal node, add children to visit queue.
+        nodes = [self]
+        parents = [None]
+        # The list doubles as the queue: nodes[i]'s children go on the end
+        for position, curr in enumerate(nodes):
             if (not (curr.left_child is None)):
-                to_visit.append(curr.left_child)
-                to_visit.append(curr.right_child)
+                nodes.append(curr.left_child)
+                nodes.append(curr.right_child)
+                parents.append(position)
+                parents.append(position)
+        return nodes, parents
+
+
+    def swap(self, node):
+        """
+        Swap expressions and children (and so subtrees, with their heights
+        and sizes) with the given node, each node keeping its place in its
+        own tree.
+        """
+        self.expr, node.expr = node.expr, self.expr
+        self.left_child, node.left_child = node.left_child, self.left_child
+        self.right_child, node.right_child = node.right_child, self.right_child
+        self.height, node.height = node.height, self.height
+        self.size, node.size = node.size, self.size
+
+
+    def intern(self):
+        """
+        Recursive method to return the shared node identical to this subtree,
+        sharing its subtrees first and making this node the shared one if
+        there isn't one yet. Subtrees that are already shared are returned
+        as they are without going into them, so interning a varied tree only
+        costs as much as the nodes variation made.
+        """
+        if (Node.interned.get((self.expr, self.left_child, self.right_child)) is self):
+            return self
+        if (not (self.left_child is None)):
+            self.left_child = self.left_child.intern()
+            self.right_child = self.right_child.intern()
+        return Node.interned.setdefault((self.expr, self.left_child, self.right_child), self)
 
 
     def copy(self, node):
@@ -213,8 +684,6 @@ class Node():
         self.expr = node.expr
         self.left_child = node.left_child
         self.right_child = node.right_child
-        self.parent = node.parent
-        self.depth = node.depth
         self.height = node.height
         self.size = node.size
 
@@ -245,28 +714,70 @@ class Node():
         return self.repr_helper(0)
 
 
+class TreeSummary():
+    """
+    What a tree can observe and do, worked out once from its nodes so the game
+    engines can skip work the tree has no use for.
+    """
+    __slots__ = ('features', 'terminals', 'can_attack')
+
+    def __init__(self, root):
+        """
+        Summarize the tree with the given root: the names of the functions
+        its internal nodes read (features), the names of its leaves
+        (terminals), and whether any leaf is attack.
+        """
+        features = set()
+        terminals = set()
+        to_visit = [root]
+        while (len(to_visit) > 0):
+            node = to_visit.pop()
+            if (node.left_child is None):
+                terminals.add(node.expr.name)
+                continue
+            if (node.expr.datatype != 'terminal'):
+                features.add(node.expr.name)
+                if (node.expr.comp_name not in (None, 'constant')):
+                    features.add(node.expr.comp_name)
+            to_visit.append(node.left_child)
+            to_visit.append(node.right_child)
+
+        self.features = frozenset(features)
+        self.terminals = frozenset(terminals)
+        self.can_attack = ('attack' in terminals)
+
+
 class DTExpr():
     """
     Decision Tree expressions that live in Nodes of the expression tree
     """
+    # Expressions are never changed once made, so identical ones are shared
+    # by all the nodes that use them through this table, and copies of a
+    # tree share its expressions instead of copying them
+    interned = weakref.WeakValueDictionary()
+
+    __slots__ = ('name', 'datatype', 'invert', 'comp_name', 'constant', '__weakref__')
+
     def __init__(self, expr_parms):
         self.name = expr_parms[0]
         self.datatype = expr_parms[1]
         self.invert = False
-        self.opts_list = expr_parms[2] if (len(expr_parms) > 2) else None
         self.comp_name = None
         self.constant = 0
 
         # If this is a real comparison, choose against what we compare it.
         if (self.datatype == 'real'):
-            self.comp_name = random.choice(self.opts_list[0])
+            self.comp_name = random.choice(expr_parms[2][0])
             if (self.comp_name == 'constant'):
-                self.constant = random.uniform(self.opts_list[1][0],
-                                               self.opts_list[1][1])
+                self.constant = random.uniform(expr_parms[2][1][0],
+                                               expr_parms[2][1][1])
 
         # Randomly choose if this comparison is inverted
-        # ("greater than" instead of "less than")
-        self.invert = (random.random() < 0.5)
+        # ("greater than" instead of "less than"). Terminals don't compare,
+        # so they're never inverted and every node with the same terminal
+        # shares one expression; the draw is made anyway so the random
+        # sequence stays the same.
+        self.invert = (random.random() < 0.5) and (self.datatype != 'terminal')
 
         # Commenting this out while it's unused
         # Generate random parameters for attack
@@ -275,6 +786,42 @@ class DTExpr():
         #     # for _ in range(6): self.opts_list.append(random.random())
 
 
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def intern(self):
+        """
+        Return the shared expression identical to this one, making this one
+        the shared one if there isn't one yet. Comparisons against a random
+        constant are almost never made twice, so they're left as they are
+        rather than paying for a table entry each (copies of a tree share
+        them anyway).
+        """
+        if (self.comp_name == 'constant'):
+            return self
+        key = (self.name, self.datatype, self.invert, self.comp_name)
+        return DTExpr.interned.setdefault(key, self)
+
+
+    def canonical(self):
+        """
+        Return a canonical string for what this expression does: just the
+        parts calc reads, with any constant written out exactly as a hex
+        float (-0.0 as 0.0), so equal constants always match and unequal ones
+        never do.
+        """
+        if (self.datatype == 'terminal'):
+            return self.name
+        canonical = ('!' if (self.invert) else '') + self.name
+        if (self.datatype == 'real'):
+            if (self.comp_name == 'constant'):
+                canonical += '<' + (float(self.constant) + 0.0).hex()
+            else:
+                canonical += '<' + self.comp_name
+        return canonical
+
+
     def calc_expr(self, precalcs):
         """
         Return the current value of this expression (name if terminal,
@@ -299,6 +846,167 @@ class DTExpr():
         return retval if (not(self.invert)) else (not(retval))
 
 
+    def source(self, names, invert = True):
+        """
+        Return this internal node's expression as a Python condition on the
+        local variables named for its inputs, adding those names to names
+        (leaving out any inversion unless invert).
+        """
+        names.add(self.name)
+        if (self.datatype == 'boolean'):
+            condition = self.name
+        else:
+            if (self.comp_name == 'constant'):
+                comp_source = repr(float(self.constant))
+            else:
+                names.add(self.comp_name)
+                comp_source = self.comp_name
+            condition = self.name + ' < ' + comp_source
+        return condition if (not(self.invert and invert)) else ('not (' + condition + ')')
+
+
+    def outcome(self, intervals, outcomes):
+        """
+        Return the value of this internal node's comparison, before any
+        inversion, if it's settled by what's known about the inputs (see
+        ExprTree._simplify_recurse), or None if it isn't.
+        """
+        if (self.datatype == 'boolean'):
+            return outcomes.get((self.name,))
+        low, high = intervals.get(self.name, (-math.inf, math.inf))
+        if (self.comp_name == 'constant'):
+            if (high <= self.constant):
+                return True
+            if (low >= self.constant):
+                return False
+            return None
+
+        # An input compared with another: settled by an earlier test of
+        # either order, or by intervals that don't overlap
+        if ((self.name, self.comp_name) in outcomes):
+            return outcomes[(self.name, self.comp_name)]
+        if (outcomes.get((self.comp_name, self.name)) == True):
+            return False
+        comp_low, comp_high = intervals.get(self.comp_name, (-math.inf, math.inf))
+        if (high <= comp_low):
+            return True
+        if (low >= comp_high):
+            return False
+        return None
+
+
+    def assume(self, intervals, outcomes, value):
+        """
+        Return copies of intervals and outcomes that also record this
+        internal node's comparison, before any inversion, coming out as value.
+        """
+        intervals = intervals.copy()
+        outcomes = outcomes.copy()
+        if (self.datatype == 'boolean'):
+            outcomes[(self.name,)] = value
+        elif (self.comp_name == 'constant'):
+            low, high = intervals.get(self.name, (-math.inf, math.inf))
+            if (value):
+                intervals[self.name] = (low, min(high, self.constant))
+            else:
+                intervals[self.name] = (max(low, self.constant), high)
+        else:
+            outcomes[(self.name, self.comp_name)] = value
+            # a < b rules out b < a
+            if (value):
+                outcomes[(self.comp_name, self.name)] = False
+        return intervals, outcomes
+
+
+    def bound(self, precalcs, monotone, bounds):
+        """
+        Narrow bounds (input name -> closed interval) to the input values for
+        which this internal node's expression keeps its current value, where
+        inputs named in monotone never decrease, and return that value (as
+        calc_expr would).
+        """
+        val1 = precalcs[self.name]
+        if (self.datatype == 'boolean'):
+            value = bool(val1)
+            DTExpr.narrow(bounds, self.name, val1, val1)
+        elif (self.comp_name == 'constant'):
+            value = (val1 < self.constant)
+            if (value):
+                DTExpr.narrow(bounds, self.name, -math.inf,
+                              float(numpy.nextafter(self.constant, -math.inf)))
+            else:
+                DTExpr.narrow(bounds, self.name, self.constant, math.inf)
+        else:
+            val2 = precalcs[self.comp_name]
+            value = (val1 < val2)
+            if ((self.name in monotone) and (self.comp_name in monotone)):
+                # With both only growing, val1 < val2 holds while the left side
+                # stays below val2's current value, and fails while the right
+                # side stays at or below val1's
+                if (value):
+                    DTExpr.narrow(bounds, self.name, -math.inf,
+                                  float(numpy.nextafter(val2, -math.inf)))
+                else:
+                    DTExpr.narrow(bounds, self.comp_name, -math.inf, val1)
+            else:
+                DTExpr.narrow(bounds, self.name, val1, val1)
+                DTExpr.narrow(bounds, self.comp_name, val2, val2)
+        return value != self.invert
+
+
+    def bound_source(self, monotone, value):
+        """
+        Return the Python statements that narrow the local bounds variables
+        (name_low and name_high for each input) the way bound does when this
+        internal node's comparison, before any inversion, comes out as value.
+        """
+        narrow = lambda name, low, high: (
+            ([name + '_low = max(' + name + '_low, ' + low + ')'] if (low is not None) else [])
+            + ([name + '_high = min(' + name + '_high, ' + high + ')'] if (high is not None) else []))
+        name = self.name
+        if (self.datatype == 'boolean'):
+            return narrow(name, name, name)
+        if (self.comp_name == 'constant'):
+            if (value):
+                return narrow(name, None, repr(float(numpy.nextafter(float(self.constant), -math.inf))))
+            return narrow(name, repr(float(self.constant)), None)
+        comp_name = self.comp_name
+        if ((name in monotone) and (comp_name in monotone)):
+            if (value):
+                return narrow(name, None, 'float(nextafter(' + comp_name + ', -inf))')
+            return narrow(comp_name, None, name)
+        return narrow(name, name, name) + narrow(comp_name, comp_name, comp_name)
+
+
+    @staticmethod
+    def narrow(bounds, name, low, high):
+        """
+        Intersect the interval for name in bounds with [low, high].
+        """
+        curr_low, curr_high = bounds.get(name, (-math.inf, math.inf))
+        bounds[name] = (max(curr_low, low), min(curr_high, high))
+
+
+    def calc_expr_batch(self, precalcs, rows):
+        """
+        Vectorized version of calc_expr for internal nodes: return a boolean
+        array with the value of this expression for each game in rows.
+        """
+        val1 = precalcs[self.name][rows]
+
+        # Check for boolean (one argument) case
+        if (self.datatype == 'boolean'):
+            retval = (val1 != 0)
+
+        # Check for comparison of real values
+        else:
+            val2 = self.constant if (self.comp_name == 'constant') \
+                else precalcs[self.comp_name][rows]
+            retval = (val1 < val2)
+
+        return retval if (not(self.invert)) else (~retval)
+
+
     def __repr__(self):
         if (self.datatype == 'terminal'):
             return self.name
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from exprTree import ExprTree, Node, DTExpr
+
+class FlatTree:
+    """
+    An expression tree stored as parallel NumPy arrays, one entry per node in
+    preorder (a node, then its left subtree, then its right subtree):
+
+        opcode[i]     TERMINAL, BOOLEAN or REAL
+        feature[i]    index into specs of the node's function or terminal
+        target[i]     for REAL nodes, index into specs of the function it's
+                      compared against, or CONSTANT; NO_TARGET otherwise
+        constant[i]   the constant it's compared against, if that's the target
+        invert[i]     whether the expression is inverted
+        extent[i]     size of the subtree rooted at node i, which therefore
+                      occupies entries i through i + extent[i] - 1
+
+    specs is the population's functions + terminals list, in the form the
+    Controllers define them. Since every subtree is a contiguous slice,
+    copying is an array copy and swapping or replacing subtrees is slicing,
+    which is also what lets StackedTrees step many trees at once. Trees
+    convert to and from the linked Node form, so __repr__ and dot_viz come
+    out the same as for the ExprTree.
+    """
+
+    # Opcodes
+    TERMINAL = 0
+    BOOLEAN = 1
+    REAL = 2
+
+    # Targets other than functions
+    NO_TARGET = -1
+    CONSTANT = -2
+
+    OPCODES = {'terminal': TERMINAL, 'boolean': BOOLEAN, 'real': REAL}
+
+    __slots__ = ('specs', 'opcode', 'feature', 'target', 'constant', 'invert', 'extent')
+
+
+    def __init__(self, specs, opcode, feature, target, constant, invert, extent):
+        """
+        Set up a tree from its specs and node arrays.
+        """
+        self.specs = specs
+        self.opcode = opcode
+        self.feature = feature
+        self.target = target
+        self.constant = constant
+        self.invert = invert
+        self.extent = extent
+
+
+    @staticmethod
+    def from_tree(tree, specs):
+        """
+        Return the FlatTree form of the given ExprTree, whose functions and
+        terminals come from specs (a population's functions + terminals).
+        """
+        indices = {spec[0]: index for index, spec in enumerate(specs)}
+        nodes = []
+        FlatTree._flatten(tree.root, nodes)
+
+        opcode = np.empty(len(nodes), dtype = np.int8)
+        feature = np.empty(len(nodes), dtype = np.int16)
+        target = np.full(len(nodes), FlatTree.NO_TARGET, dtype = np.int16)
+        constant = np.zeros(len(nodes))
+        invert = np.empty(len(nodes), dtype = bool)
+        extent = np.empty(len(nodes), dtype = np.int32)
+        for index, (node, node_extent) in enumerate(nodes):
+            expr = node.expr
+            opcode[index] = FlatTree.OPCODES[expr.datatype]
+            feature[index] = indices[expr.name]
+            if (expr.datatype == 'real'):
+                if (expr.comp_name == 'constant'):
+                    target[index] = FlatTree.CONSTANT
+                    constant[index] = expr.constant
+                else:
+                    target[index] = indices[expr.comp_name]
+            invert[index] = expr.invert
+            extent[index] = node_extent
+        return FlatTree(specs, opcode, feature, target, constant, invert, extent)
+
+
+    @staticmethod
+    def _flatten(node, nodes):
+        """
+        Recursive helper for from_tree: append (node, subtree size) for the
+        node and its subtree to nodes in preorder and return the subtree size.
+        """
+        position = len(nodes)
+        nodes.append(None)
+        extent = 1
+        if (node.left_child is not None):
+            extent += FlatTree._flatten(node.left_child, nodes)
+            extent += FlatTree._flatten(node.right_child, nodes)
+        nodes[position] = (node, extent)
+        return extent
+
+
+    def __len__(self):
+        """
+        Return the number of nodes in the tree.
+        """
+        return len(self.opcode)
+
+
+    def __repr__(self):
+        return repr(self.to_tree().root)
+
+
+    def to_tree(self):
+        """
+        Return this tree as a (new) ExprTree of linked Nodes.
+        """
+        root, _ = self._build_node(0)
+        root.reset_metrics()
+        return ExprTree(root)
+
+
+    def _build_node(self, index):
+        """
+        Recursive helper for to_tree: return the Node for the subtree at
+        index along with the index just past the subtree.
+        """
+        spec = self.specs[self.feature[index]]
+        # Rebuild the expression as it was, without DTExpr's random choices
+        expr = DTExpr.__new__(DTExpr)
+        expr.name = spec[0]
+        expr.datatype = spec[1]
+        expr.invert = bool(self.invert[index])
+        expr.comp_name = None
+        expr.constant = 0
+        if (self.opcode[index] == FlatTree.REAL):
+            if (self.target[index] == FlatTree.CONSTANT):
+                expr.comp_name = 'constant'
+                expr.constant = float(self.constant[index])
+            else:
+                expr.comp_name = self.specs[self.target[index]][0]
+
+        node = Node(expr.intern())
+        end = index + int(self.extent[index])
+        if (end > index + 1):
+            node.left_child, right_index = self._build_node(index + 1)
+            node.right_child, _ = self._build_node(right_index)
+        return node, end
+
+
+    def copy(self):
+        """
+        Return a copy of this tree.
+        """
+        return FlatTree(self.specs, self.opcode.copy(), self.feature.copy(),
+                        self.target.copy(), self.constant.copy(), self.invert.copy(),
+                        self.extent.copy())
+
+
+    def breadth_first(self):
+        """
+        Return the index of every node in breadth-first order, so the nth
+        node in the order Node.breadth_first lists them (counting from 1) is
+        at index breadth_first()[n - 1].
+        """
+        indices = [0]
+        # The list doubles as the queue: indices[i]'s children go on the end
+        for index in indices:
+            if (self.extent[index] > 1):
+                indices.append(index + 1)
+                indices.append(index + 1 + int(self.extent[index + 1]))
+        return np.array(indices)
+
+
+    def depths(self):
+        """
+        Return the depth of every node, from one pass over the nodes in
+        preorder that keeps the end of each subtree the current node is in.
+        """
+        depths = np.empty(len(self), dtype = np.int32)
+        ends = []
+        for index, extent in enumerate(self.extent.tolist()):
+            while ((len(ends) > 0) and (ends[-1] <= index)):
+                ends.pop()
+            depths[index] = len(ends)
+            ends.append(index + extent)
+        return depths
+
+
+    def height(self, index = 0):
+        """
+        Return the height of the subtree at index.
+        """
+        return int(self.subtree(index).depths().max())
+
+
+    def subtree(self, index):
+        """
+        Return a copy of the subtree at index as a tree of its own.
+        """
+        end = index + self.extent[index]
+        return FlatTree(self.specs, self.opcode[index:end].copy(),
+                        self.feature[index:end].copy(), self.target[index:end].copy(),
+                        self.constant[index:end].copy(), self.invert[index:end].copy(),
+                        self.extent[index:end].copy())
+
+
+    def replace(self, index, other):
+        """
+        Return a new tree with the subtree at index replaced by (a copy of)
+        the tree other.
+        """
+        end = index + self.extent[index]
+        # Every subtree containing the replaced one changes size with it
+        positions = np.arange(len(self))
+        extent = self.extent.copy()
+        extent[(positions < index) & (positions + extent > index)] += len(other) - self.extent[index]
+
+        splice = lambda mine, theirs: np.concatenate((mine[:index], theirs, mine[end:]))
+        return FlatTree(self.specs, splice(self.opcode, other.opcode),
+                        splice(self.feature, other.feature), splice(self.target, other.target),
+                        splice(self.constant, other.constant), splice(self.invert, other.invert),
+                        np.concatenate((extent[:index], other.extent, extent[end:])))
+
+
+    def relabel(self, index, other):
+        """
+        Return a new tree with the node at index given the expression of the
+        root of other, keeping its subtree.
+        """
+        tree = self.copy()
+        for name in ('opcode', 'feature', 'target', 'constant', 'invert'):
+            getattr(tree, name)[index] = getattr(other, name)[0]
+        return tree
+
+
+    def swap(self, index, other, other_index):
+        """
+        Return the two new trees made by swapping the subtree at index in
+        this tree with the subtree at other_index in other.
+        """
+        return (self.replace(index, other.subtree(other_index)),
+                other.replace(other_index, self.subtree(index)))
+
+
+class StackedTrees:
+    """
+    Many trees in FlatTree form, padded to a common length and stacked end
+    to end in flat arrays (tree k's node i at k * width + i), for evaluating
+    many trees on many games at once.
+
+    calc moves every game one level down its tree per step with a few array
+    operations, so a turn of hundreds of games costs about as many steps as
+    the deepest tree rather than a Python call per node per tree.
+    """
+
+    def __init__(self, trees, specs):
+        """
+        Stack the given ExprTrees, whose functions and terminals come from
+        specs (a population's functions + terminals).
+        """
+        flats = [FlatTree.from_tree(tree, specs) for tree in trees]
+        self.width = max(len(flat) for flat in flats)
+
+        self.specs = specs
+        # Indices of the functions (game values to look up) any tree reads
+        read = set().union(*(tree.summarize().features for tree in trees))
+        self.functions = [index for index, spec in enumerate(specs) if (spec[0] in read)]
+
+        # Padding entries are leaves, which are never stepped into
+        size = len(flats) * self.width
+        opcode = np.full(size, FlatTree.TERMINAL, dtype = np.int8)
+        self.feature = np.zeros(size, dtype = np.int64)
+        target = np.full(size, FlatTree.NO_TARGET, dtype = np.int64)
+        self.constant = np.zeros(size)
+        self.invert = np.zeros(size, dtype = bool)
+        extent = np.ones(size, dtype = np.int64)
+        for row, flat in enumerate(flats):
+            start = row * self.width
+            opcode[start:start + len(flat)] = flat.opcode
+            self.feature[start:start + len(flat)] = flat.feature
+            target[start:start + len(flat)] = flat.target
+            self.constant[start:start + len(flat)] = flat.constant
+            self.invert[start:start + len(flat)] = flat.invert
+            extent[start:start + len(flat)] = flat.extent
+
+        # What calc needs per node: does it have children, is it a boolean,
+        # does it compare at all (a terminal with children always goes right;
+        # see Node.calc), what does it compare against, and where does its
+        # right subtree start?
+        positions = np.arange(size)
+        self.internal = (extent > 1)
+        self.boolean = (opcode == FlatTree.BOOLEAN)
+        self.compares = (opcode != FlatTree.TERMINAL)
+        self.constant_target = (target == FlatTree.CONSTANT)
+        self.target = np.maximum(target, 0)
+        self.right = positions + 1 + extent[np.minimum(positions + 1, size - 1)]
+
+
+    def features(self, precalcs, rows):
+        """
+        Given precalcs mapping each function name to an array of values (one
+        per game), return the feature matrix of the games in rows: one row per
+        game and one column per spec (the columns of terminals and of functions
+        no tree reads are left at 0).
+        """
+        values = np.zeros((len(rows), len(self.specs)))
+        for index in self.functions:
+            values[:, index] = precalcs[self.specs[index][0]][rows]
+        return values
+
+
+    def calc(self, trees, values):
+        """
+        Given the index of the tree each game is played by and the games'
+        feature matrix, return the spec index of the terminal each tree
+        decides on for its game (the same as Node.calc would).
+        """
+        values = values.ravel()
+        num_specs = len(self.specs)
+        node = trees * self.width
+        # Games still at an internal node
+        active = np.arange(len(trees))
+        while (len(active) > 0):
+            at = node[active]
+            internal = self.internal[at]
+            active = active[internal]
+            at = at[internal]
+
+            offsets = active * num_specs
+            value = values[offsets + self.feature[at]]
+            comp_value = np.where(self.constant_target[at], self.constant[at],
+                                  values[offsets + self.target[at]])
+            result = np.where(self.boolean[at], value != 0, value < comp_value)
+            result ^= self.invert[at]
+            result &= self.compares[at]
+
+            # Step into the left subtree, or into the right one past it
+            node[active] = np.where(result, at + 1, self.right[at])
+
+        return self.feature[node]
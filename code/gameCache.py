@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+class GameCache:
+    """
+    Size-bounded memo of game outcomes that drops the least recently used
+    outcome when full.
+
+    Games are keyed by the canonical hashes of both trees and the game's seed.
+    Given the experiment's game parameters those settle everything about a
+    game, so a cached outcome is exactly what playing the game again would
+    give.
+    """
+
+    def __init__(self, size):
+        """
+        Set up an empty cache holding at most size outcomes.
+        """
+        self.size = size
+        self.outcomes = OrderedDict()
+        self.hits = 0
+        self.lookups = 0
+
+
+    @staticmethod
+    def key(attacker_individual, defender_individual, seed):
+        """
+        Return the cache key of a game between the given trees with the given
+        seed (an int or a numpy SeedSequence).
+        """
+        if (not isinstance(seed, int)):
+            seed = (seed.entropy, seed.spawn_key)
+        return (attacker_individual.canonical_hash(), defender_individual.canonical_hash(), seed)
+
+
+    def get(self, key):
+        """
+        Return the cached outcome for key, or None if there isn't one.
+        """
+        self.lookups += 1
+        outcome = self.outcomes.get(key)
+        if (outcome is not None):
+            self.hits += 1
+            self.outcomes.move_to_end(key)
+        return outcome
+
+
+    def put(self, key, outcome):
+        """
+        Cache the outcome for key, making room if the cache is full.
+        """
+        self.outcomes[key] = outcome
+        self.outcomes.move_to_end(key)
+        if (len(self.outcomes) > self.size):
+            self.outcomes.popitem(last = False)
+
+
+    def reset_counts(self):
+        """
+        Start counting hits and lookups over.
+        """
+        self.hits = 0
+        self.lookups = 0
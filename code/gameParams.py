@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+from scipy.stats import norm
+
+class GameParams:
+    """
+    Immutable game parameters shared by every game of an experiment.
+
+    Built once from the Experiment so that games don't copy the parameters
+    (or recompute the constants derived from them) every time one is set up.
+    """
+
+    __slots__ = ('defender_strategy', 'time_limit', 'ca_classifiers',
+                 'lambda_u', 'beta_u', 'sigma_u', 'eta_u', 'nu_r',
+                 'delta_l', 'delta_a', 'q', 'gamma', 'rho',
+                 'user_bonus', 'attacker_penalty', 'IDLess', 'history_length',
+                 'fast_forward',
+                 'c_r', 'discount', 'omega_decay')
+
+
+    def __init__(self, experiment):
+        """
+        Copy the game parameters off the experiment and precompute the
+        derived constants.
+        """
+        set_value = lambda name, value: object.__setattr__(self, name, value)
+
+        set_value('defender_strategy', experiment.defender_strategy)
+        set_value('time_limit', experiment.game_time_limit)
+        # Which CA clasifiers are we using? (currently none)
+        set_value('ca_classifiers', tuple(experiment.ca_classifiers))
+
+        set_value('lambda_u', experiment.lambda_u)
+        set_value('beta_u', experiment.beta_u)
+        set_value('sigma_u', experiment.sigma_u)
+        set_value('eta_u', experiment.eta_u)
+        set_value('nu_r', experiment.nu_r)
+        set_value('delta_l', experiment.delta_l)
+        set_value('delta_a', experiment.delta_a)
+        set_value('q', experiment.q)
+        set_value('gamma', experiment.gamma)
+        set_value('rho', experiment.rho)
+        set_value('user_bonus', experiment.user_bonus)
+        set_value('attacker_penalty', experiment.attacker_penalty)
+        # Do we have the IDS serve as the end-game or the defender?
+        set_value('IDLess', experiment.IDLess)
+        # How many turns of per-turn history a game keeps (0 = all of them)
+        set_value('history_length', experiment.history_length)
+        # Skip over stretches of turns whose outcome is already settled?
+        set_value('fast_forward', experiment.fast_forward)
+
+        # Cut-off point for detecting attack: if beta_u > c then positive
+        # (assuming being attacked); false positives possible
+        # the cut off is the point at which the area under the normal curve to
+        # the right of the cut off is equal to the false positive rate
+        set_value('c_r', norm.ppf(1 - self.eta_u, self.beta_u, self.sigma_u))
+
+        # Attacker reward discount rho ** (t - 1), indexed by t
+        max_t = int(math.ceil(self.time_limit))
+        discount = self.rho ** (np.arange(max_t + 1) - 1.0)
+        discount.flags.writeable = False
+        set_value('discount', discount)
+
+        # exp(-gamma * omega), indexed by omega, for the attacker's behavior
+        # model. omega is total observed user traffic, so it can't exceed a
+        # generous upper bound on the traffic of a whole game; past the point
+        # where the term no longer changes 1 + exp(-gamma * omega) there's no
+        # need to go further either.
+        max_traffic = self.lambda_u * max_t
+        max_omega = int(max_traffic + 10 * math.sqrt(max_traffic) + 10)
+        if (self.gamma > 0):
+            max_omega = min(max_omega, int(40 / self.gamma) + 1)
+        omega_decay = np.exp(-self.gamma * np.arange(max_omega + 1))
+        omega_decay.flags.writeable = False
+        set_value('omega_decay', omega_decay)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError('GameParams is immutable')
+
+
+    def __getstate__(self):
+        return {name: getattr(self, name) for name in GameParams.__slots__}
+
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            object.__setattr__(self, name, value)
+
+
+    def attack_scale(self, omega):
+        """
+        Return the factor 1 + exp(-gamma * omega) by which the attacker's
+        behavior mean and deviation exceed the user's after omega
+        observations.
+        """
+        if (omega < len(self.omega_decay)):
+            return 1 + float(self.omega_decay[omega])
+        return 1 + math.exp(-self.gamma * omega)
+
+
+    def attacker_discount(self, t):
+        """
+        Return rho ** (t - 1), the discount on attacker reward at time t.
+        """
+        if (t < len(self.discount)):
+            return float(self.discount[t])
+        return self.rho ** (t - 1)
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+from gameState import GameState, WorldTrace
+from batchGameState import BatchGameState
+from randomTape import RandomTape
+from controllers import AttackerController, DefenderController
+from exprTree import ExprTree
+
+class GamePool:
+    """
+    Worker processes that play seeded games in parallel, kept for a whole
+    run so they're only started (and handed the game parameters) once.
+
+    Games go out in chunks, each carrying the roots of the distinct trees it
+    uses (once each, however many of its games they play) along with the
+    pairings as indices into them and a seed per game. A seeded game comes
+    out the same wherever it's played, and chunks come back in the order they
+    went out, so the scores are exactly those of playing the games in the
+    main process, in the same order.
+    """
+
+    # Chunks per worker per call, so that slow chunks even out
+    CHUNKS_PER_WORKER = 4
+
+    # Set in each worker process by start_worker
+    params = None
+    game_engine = None
+
+
+    def __init__(self, workers, params, game_engine):
+        """
+        Start workers processes to play games with the given GameParams and
+        game engine (serial or batch).
+        """
+        self.workers = workers
+        self.game_engine = game_engine
+        self.executor = ProcessPoolExecutor(max_workers = workers,
+                                            initializer = GamePool.start_worker,
+                                            initargs = (params, game_engine))
+
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        self.executor.shutdown()
+
+
+    def play_games(self, pairings, seeds):
+        """
+        Play one game for each (Attacker individual, Defender individual) pair
+        in pairings, game i drawing its random numbers from seeds[i], and
+        return a list of the raw (Attacker score, Defender score) of each game
+        in pairing order.
+        """
+        # The batch engine plays a chunk in lockstep, so it's better off with
+        # one big chunk per worker
+        num_chunks = self.workers
+        if (self.game_engine != 'batch'):
+            num_chunks *= GamePool.CHUNKS_PER_WORKER
+        chunk_size = max(1, math.ceil(len(pairings) / num_chunks))
+        chunks = [GamePool.pack(pairings[start:start + chunk_size], seeds[start:start + chunk_size])
+                  for start in range(0, len(pairings), chunk_size)]
+        scores = []
+        for chunk_scores in self.executor.map(GamePool.play_chunk, chunks):
+            scores += chunk_scores
+        return scores
+
+
+    @staticmethod
+    def pack(pairings, seeds):
+        """
+        Return the payload of a chunk of games: the roots of the distinct
+        trees the games use, the (Attacker, Defender) indices into those of
+        each game, and the games' seeds.
+        """
+        positions = {}
+        roots = []
+        indices = []
+        for pairing in pairings:
+            game_indices = []
+            for individual in pairing:
+                if (id(individual) not in positions):
+                    positions[id(individual)] = len(roots)
+                    roots.append(individual.root)
+                game_indices.append(positions[id(individual)])
+            indices.append(tuple(game_indices))
+        return roots, indices, list(seeds)
+
+
+    @staticmethod
+    def start_worker(params, game_engine):
+        """
+        Set up a worker process to play games with the given GameParams and
+        game engine.
+        """
+        GamePool.params = params
+        GamePool.game_engine = game_engine
+
+
+    @staticmethod
+    def play_chunk(chunk):
+        """
+        Play the games of a chunk (see pack) in a worker and return their raw
+        (Attacker score, Defender score) in order.
+        """
+        roots, indices, seeds = chunk
+        params = GamePool.params
+        trees = [ExprTree(root) for root in roots]
+
+        if (GamePool.game_engine == 'batch'):
+            tape = RandomTape(seeds, params.lambda_u, min(params.time_limit, RandomTape.CHUNK))
+            batch = BatchGameState(params, [trees[attacker] for attacker, _ in indices],
+                                   [trees[defender] for _, defender in indices], tape)
+            batch.play()
+            return list(zip(batch.calculate_attacker_fitness().tolist(),
+                            batch.calculate_defender_fitness().tolist()))
+
+        # Games with the same seed share one tape
+        tapes = {}
+        world_data = WorldTrace('off')
+        scores = []
+        for (attacker, defender), seed in zip(indices, seeds):
+            if (seed not in tapes):
+                tapes[seed] = RandomTape([seed], params.lambda_u,
+                                         min(params.time_limit, RandomTape.CHUNK))
+            game_state = GameState(params, tapes[seed])
+            attacker_controllers = [AttackerController(0, trees[attacker])]
+            defender_controllers = [DefenderController(0, trees[defender])]
+            game_over = False
+            while (not game_over):
+                game_over = game_state.play_turn(world_data, attacker_controllers,
+                                                 defender_controllers)
+            scores.append((game_state.calculate_attacker_fitness(),
+                           game_state.calculate_defender_fitness()))
+        return scores
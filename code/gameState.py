@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
+import math
 import random
 import numpy as np
-import math
-from scipy.stats import norm
+from array import array
+
+from randomTape import RandomTape
+from historyBuffer import HistoryBuffer
 
 class GameState:
     """
@@ -14,17 +17,40 @@ class GameState:
     BLOCKED = 1
     ATTACKER_DETECTED = 2
 
+    # Tree inputs that never go down during a game, which fast_forward can
+    # bound from one side only
+    MONOTONE = ('T', 'AO', 'AR')
 
-    def __init__(self, experiment):
-        """
-        Set up the game state given initialization parameters as listed.
+    # How many turns fast_forward looks ahead at first, and the most turns
+    # play_turn waits before trying it again after it found nothing to skip
+    FAST_FORWARD_WINDOW = 16
+    FAST_FORWARD_MAX_BACKOFF = 16
+
+    # Action codes, for when moves are kept in arrays instead of strings
+    ACTIONS = ['attack', 'listen', 'wait', 'block', 'unblock']
+    ACTION_CODES = {name: code for code, name in enumerate(ACTIONS)}
+
+    # Thousands of these can be in flight at once, so skip the per-instance dict
+    __slots__ = ('params', 't', 'state', 'time_blocked', 'user_history', 'A_u',
+                 'behavior_history', 'behavior_mask', 'sum_of_behavior_mask',
+                 'listening_mask', 'omega', 'attacker_reward', 'tape', 'tape_row',
+                 'fast_forward_wait', 'fast_forward_backoff')
+
+    def __init__(self, params, tape = None, tape_row = 0):
         """
-        self.defender_strategy = experiment.defender_strategy
+        Set up the game state given the experiment's shared GameParams.
 
-        self.time_limit = experiment.game_time_limit
+        Random values are read from row tape_row of the given RandomTape; if
+        no tape is given, the game draws its own from a seed taken from the
+        (seeded) random module.
+        """
+        # game parameters (shared, read-only):
+        self.params = params
 
-        # Which CA clasifiers are we using? (currently none)
-        self.ca_classifiers = experiment.ca_classifiers
+        # Per-turn histories go in preallocated arrays covering the whole game,
+        # or in ring buffers of the last history_length turns if that's set
+        ring = (params.history_length > 0)
+        capacity = params.history_length if ring else params.time_limit
 
         # game invariants and measurements:
         self.t = 0
@@ -32,50 +58,38 @@ class GameState:
         # How long has the game been blocked in total?
         self.time_blocked = 0
         # amount of traffic generated by the user each turn
-        self.user_history = []
+        self.user_history = HistoryBuffer(capacity, 'int64', ring)
         # A_u = total traffic generated by the user (sum of user_history)
         self.A_u = 0
         # user behavior values (only relevant when traffic is generated)
-        self.behavior_history = []
+        self.behavior_history = HistoryBuffer(capacity, 'float64', ring)
         # behavior_mask is 1 for turn t if A(t) > 0, and 0 otherwise
-        self.behavior_mask = []
+        self.behavior_mask = HistoryBuffer(capacity, 'bool', ring)
         # the defender is interested in maximizing either A_u or the total
         # number of successful user interactions, so track the latter in case
         self.sum_of_behavior_mask = 0
         # listening mask is 1 if the attacker is listening at turn t
-        self.listening_mask = []
+        self.listening_mask = HistoryBuffer(capacity, 'bool', ring)
         # Amount of user traffic observed by the attacker
         # omega = L(t) = \sum_i A(t_i) * (l(t_i) == 1)
         self.omega = 0
         # Amount of successful attacks by the attacker
         self.attacker_reward = 0
 
-        # game parameters:
-        self.lambda_u = experiment.lambda_u
-        self.beta_u = experiment.beta_u
-        self.sigma_u = experiment.sigma_u
-        self.eta_u = experiment.eta_u
-        self.nu_r = experiment.nu_r
-        self.delta_l = experiment.delta_l
-        self.delta_a = experiment.delta_a
-        self.q = experiment.q
-        self.gamma = experiment.gamma
-        self.rho = experiment.rho
-        # we're out of Greek, someone as the frats for more
-        self.user_bonus = experiment.user_bonus
-        self.attacker_penalty = experiment.attacker_penalty
-
-        # Do we have the IDS serve as the end-game or the defender?
-        self.IDLess = experiment.IDLess
-        
         #self.m = 0
         #self.C_a = 0
 
-        # Cut-off point for detecting attack: if beta_u > c then positive
-        # (assuming being attacked); false positives possible
-        # the cut off is the point at which the area under the normal curve to
-        # the right of the cut off is equal to the false positive rate
-        self.c_r = norm.ppf(1 - self.eta_u, self.beta_u, self.sigma_u)
+        # Where this game's random numbers come from
+        if (tape is None):
+            tape = RandomTape([random.getrandbits(128)], params.lambda_u,
+                              min(params.time_limit, RandomTape.CHUNK))
+        self.tape = tape
+        self.tape_row = tape_row
+
+        # Turns to go before fast_forward is tried again, and how many to
+        # wait the next time it finds nothing to skip
+        self.fast_forward_wait = 0
+        self.fast_forward_backoff = 0
 
 
     def T(self):
@@ -110,7 +124,7 @@ class GameState:
         Return the last observed behavior value from 
         user or attacker
         """
-        return self.behavior_history[-1]
+        return self.behavior_history.last()
 
     def BM(self):
         """
@@ -120,12 +134,12 @@ class GameState:
         true in an evolved algorithm, other than the let the EA figure it out
         itself, so *shrug*
         """
-        return self.behavior_mask[-1]
+        return self.behavior_mask.last()
 
     def play_turn(self, world_data, attacker_controllers, defender_controllers):
         """
-        Play a turn of a game given world_data to log world updates
-        and controllers for Attacker and Defenders.
+        Play a turn of a game given world_data (a WorldTrace) to log world
+        updates and controllers for Attacker and Defenders.
 
         During a turn, the following takes place (somewhat sequentially):
 
@@ -162,17 +176,33 @@ class GameState:
 
         # If we're here we know the game isn't over, but that could change.
         game_over = False
-
-        # Increment time step. Type in unnecessary comments.
-        self.t += 1
-            
-        if (self.state == GameState.BLOCKED): self.time_blocked += 1
+        params = self.params
 
         # Assume one attacker and one defender for now
         # NOTE multi-user / attacker situations might be easy to extend
         attacker = attacker_controllers[0]
         defender = defender_controllers[0]
 
+        # Jump over any turns coming up in which nothing can happen. Looking
+        # costs several turns' worth of time, so after coming up empty wait a
+        # while (longer each time) before looking again
+        if (params.fast_forward):
+            if (self.fast_forward_wait > 0):
+                self.fast_forward_wait -= 1
+            elif (self.fast_forward(world_data, attacker, defender) > 0):
+                self.fast_forward_backoff = 0
+            else:
+                self.fast_forward_wait = self.fast_forward_backoff
+                self.fast_forward_backoff = min(max(1, 2 * self.fast_forward_backoff),
+                                                GameState.FAST_FORWARD_MAX_BACKOFF)
+
+        # Increment time step. Type in unnecessary comments.
+        self.t += 1
+        self.tape.ensure(self.t)
+        turn = self.t - 1
+
+        if (self.state == GameState.BLOCKED): self.time_blocked += 1
+
         # First let the attacker decide their move
 
         # Attacker
@@ -185,10 +215,11 @@ class GameState:
 
         # Then the user generates traffic if the game state allows
         if (self.state == GameState.UNBLOCKED):
-            self.user_history.append(np.random.poisson(self.lambda_u))
-            self.A_u += self.user_history[-1]
+            traffic = int(self.tape.traffic[self.tape_row, turn])
+            self.A_u += traffic
         else:
-            self.user_history.append(0)
+            traffic = 0
+        self.user_history.append(traffic)
 
         # If the attacker decides to attack, the traffic generated by the
         # attacker currently subsumes any traffic generated by the user in the
@@ -196,22 +227,22 @@ class GameState:
         if (attacker.next_move == 'attack' and
             self.state == GameState.UNBLOCKED):
             # Use basic model with no CA classifiers
-            if (len(self.ca_classifiers) == 0):
-                self.behavior_history.append(np.random.normal(
-                    self.beta_u * (1 + math.exp(-self.gamma * self.omega)),
-                    self.sigma_u * (1 + math.exp(-self.gamma * self.omega))))
+            if (len(params.ca_classifiers) == 0):
+                scale = params.attack_scale(self.omega)
+                self.behavior_history.append(
+                    (params.beta_u + params.sigma_u * self.tape.noise[self.tape_row, turn]) * scale)
                 self.behavior_mask.append(True)
-        elif (self.user_history[-1]):
+        elif (traffic):
             # if the user generates any traffic, that behavior is N(beta_u, sigma_u)
-            self.behavior_history.append(np.random.normal(self.beta_u,
-                                                          self.sigma_u))
+            self.behavior_history.append(
+                params.beta_u + params.sigma_u * self.tape.noise[self.tape_row, turn])
             self.behavior_mask.append(True)
         else:
             self.behavior_history.append(0)
             self.behavior_mask.append(False)
 
         # Defender
-        if (self.defender_strategy == 'ccegp'):
+        if (params.defender_strategy == 'ccegp'):
             defender.decide_move(self)
         else: # using defender with static false positive rate:
             # First check if the game is currently blocked, then there's nothing
@@ -220,29 +251,31 @@ class GameState:
                 defender.next_move = 'block'
             else:
                 # (if behavior > false positive cut-off)
-                if ((self.behavior_mask[-1])
-                    and (self.behavior_history[-1] > self.c_r)):
+                if ((self.behavior_mask.last())
+                    and (self.behavior_history.last() > params.c_r)):
                     defender.next_move = 'block'
                 else:
                     defender.next_move = 'unblock'
 
+        uniforms = self.tape.uniforms[self.tape_row, turn].tolist()
+
         # transition to blocked if the defender decides to block
         if (self.state == GameState.UNBLOCKED and defender.next_move == 'block'):
             self.state = GameState.BLOCKED
         elif (self.state == GameState.BLOCKED):
             # remain blocked with probability q
-            self.state = (GameState.UNBLOCKED, GameState.BLOCKED)[np.random.uniform(0,1) < self.q]
+            self.state = (GameState.UNBLOCKED, GameState.BLOCKED)[uniforms[RandomTape.UNBLOCK] < params.q]
         # else remain unblocked
 
         if (attacker.next_move == 'listen'):
-            if (random.random() < self.delta_l):
+            if (uniforms[RandomTape.LISTEN] < params.delta_l):
                 self.state = GameState.ATTACKER_DETECTED
             else:
-                self.omega += self.user_history[-1] #TODO: index by t for less confusion
+                self.omega += traffic
         elif (attacker.next_move == 'attack'):
-            if ((not self.IDLess) and (random.random() < self.delta_a)):
+            if ((not params.IDLess) and (uniforms[RandomTape.ATTACK] < params.delta_a)):
                 self.state = GameState.ATTACKER_DETECTED
-            elif ((self.IDLess) and (defender.next_move == 'block')):
+            elif ((params.IDLess) and (defender.next_move == 'block')):
                 self.state = GameState.ATTACKER_DETECTED
             elif (self.state != GameState.BLOCKED and defender.next_move != 'block'):
                 self.attacker_reward += 1
@@ -250,26 +283,178 @@ class GameState:
 
         # If attacker is detected, game over
         if ((self.state == GameState.ATTACKER_DETECTED)
-            or (self.t >= self.time_limit)):
+            or (self.t >= params.time_limit)):
             game_over = True
 
         # If doing attacker only evolving, check if the attacker is "passive", and
         # if so, there's no point in continuing the game until the time limit
-        if (self.defender_strategy == 'saritas' and attacker.tree.is_passive()):
+        if (params.defender_strategy == 'saritas' and attacker.tree.is_passive()):
             game_over = True
-            # note this check is constant over the entire game (and shouldn't be
-            # done repeatedly here, but this is just a quick place I know to put it)
+            # note this check is constant over the entire game (the tree's
+            # summary works it out once, so repeating it here is cheap)
         # Logging
-        world_data.append('attacker: ' + attacker.next_move + ' vs. defender: '
-                          + defender.next_move + '\n')
+        world_data.record(attacker.next_move, defender.next_move)
 
         return game_over
 
+    def fast_forward(self, world_data, attacker, defender):
+        """
+        Skip ahead over the coming turns in which neither player's move can
+        change and nothing happens but bookkeeping, leaving the game ready to
+        play the turn that breaks the stretch.
+
+        Each tree's move holds for as long as its inputs stay in the decision
+        region (see Node.region) around their values on the first turn of the
+        stretch. Until something happens, B stays put, T counts up, AO grows
+        by the traffic the attacker listens to, AR by one per attack, and BM
+        and BH follow the tape, so the first turn on which either tree could
+        leave its region can be read off the tape, as can the first turn
+        whose random numbers set off an event (the game unblocking or getting
+        blocked, or the IDS catching the attacker). The stretch ends at the
+        earliest of these, which is the first turn playing turn by turn could
+        have gone differently, so games come out exactly the same either way.
+        Return the number of turns skipped.
+        """
+        params = self.params
+
+        # Always play the first turn, which is where a passive attacker in
+        # attacker-only evolution ends the game
+        if (self.t == 0):
+            return 0
+
+        start = self.t + 1
+        blocked = (self.state == GameState.BLOCKED)
+
+        # The attacker's move and the region it holds in
+        attacker_move, attacker_bounds = attacker.tree.region(
+            {'T': start, 'B': self.state, 'AO': self.omega, 'AR': self.attacker_reward},
+            GameState.MONOTONE)
+
+        # Leave the last turn of the game to play_turn, and don't look past
+        # the last turn the attacker's T bound allows
+        last = int(math.ceil(params.time_limit)) - 1
+        attacker_time_limit = attacker_bounds.get('T', (-math.inf, math.inf))[1]
+        if (attacker_time_limit < last):
+            last = int(math.floor(attacker_time_limit))
+        if (last < start):
+            return 0
+
+        # Most stretches are short, so look ahead a window of turns at a time,
+        # doubling it for as long as the stretch runs to the end of it
+        window = GameState.FAST_FORWARD_WINDOW
+        defender_move = None
+        while (True):
+            end = min(last, start + window - 1)
+            turns, uniforms, traffic, behavior_mask, behavior = \
+                self.look_ahead(start, end, blocked, attacker_move)
+
+            # The defender's move, and the turns on which it might change
+            if (params.defender_strategy == 'ccegp'):
+                if (defender_move is None):
+                    defender_move, defender_bounds = defender.tree.region(
+                        {'T': start, 'BM': behavior_mask[0], 'BH': behavior[0]},
+                        GameState.MONOTONE)
+                    if ((not blocked) and (defender_move == 'block')):
+                        return 0
+                events = (GameState.outside(defender_bounds, 'T', turns)
+                          | GameState.outside(defender_bounds, 'BM', behavior_mask)
+                          | GameState.outside(defender_bounds, 'BH', behavior))
+            else:
+                defender_move = 'block' if (blocked) else 'unblock'
+                events = np.zeros(len(turns), dtype=bool)
+                if (not blocked):
+                    events |= behavior_mask & (behavior > params.c_r)
+
+            # The turns on which the attacker's growing inputs might change its move
+            if ((not blocked) and (attacker_move == 'listen')):
+                observed = self.omega + np.concatenate(([0], np.cumsum(traffic[:-1])))
+                events |= GameState.outside(attacker_bounds, 'AO', observed)
+            elif ((not blocked) and (attacker_move == 'attack')):
+                rewards = self.attacker_reward + np.arange(len(turns))
+                events |= GameState.outside(attacker_bounds, 'AR', rewards)
+
+            # The turns whose random numbers set off an event
+            if (blocked):
+                events |= (uniforms[:, RandomTape.UNBLOCK] >= params.q)
+            if (attacker_move == 'listen'):
+                events |= (uniforms[:, RandomTape.LISTEN] < params.delta_l)
+            elif (attacker_move == 'attack'):
+                if (not params.IDLess):
+                    events |= (uniforms[:, RandomTape.ATTACK] < params.delta_a)
+                elif (defender_move == 'block'):
+                    events[:] = True
+
+            num_turns = int(np.argmax(events)) if (events.any()) else len(events)
+            if ((num_turns < len(events)) or (end == last)):
+                break
+            window *= 2
+        if (num_turns == 0):
+            return 0
+
+        # Book the quiet turns
+        self.t += num_turns
+        self.listening_mask.extend(np.full(num_turns, attacker_move == 'listen'))
+        traffic = traffic[:num_turns]
+        self.user_history.extend(traffic)
+        self.behavior_history.extend(behavior[:num_turns])
+        self.behavior_mask.extend(behavior_mask[:num_turns])
+        if (blocked):
+            self.time_blocked += num_turns
+        else:
+            self.A_u += int(traffic.sum())
+            if (attacker_move == 'listen'):
+                self.omega += int(traffic.sum())
+            elif (attacker_move == 'attack'):
+                self.attacker_reward += num_turns
+        for _ in range(num_turns):
+            world_data.record(attacker_move, defender_move)
+        return num_turns
+
+
+    def look_ahead(self, start, end, blocked, attacker_move):
+        """
+        Return what turns start through end would look like if nothing
+        happened during them: the turn numbers, the tape's uniforms, and the
+        user traffic, behavior mask and behavior the defender would see.
+        """
+        params = self.params
+        self.tape.ensure(end)
+        turns = np.arange(start, end + 1)
+        uniforms = self.tape.uniforms[self.tape_row, start - 1:end]
+        if (blocked):
+            traffic = np.zeros(len(turns), dtype=np.int64)
+            behavior_mask = np.zeros(len(turns), dtype=bool)
+            behavior = np.zeros(len(turns))
+        else:
+            traffic = self.tape.traffic[self.tape_row, start - 1:end]
+            noise = self.tape.noise[self.tape_row, start - 1:end]
+            if (attacker_move == 'attack'):
+                behavior_mask = np.ones(len(turns), dtype=bool)
+                behavior = ((params.beta_u + params.sigma_u * noise)
+                            * params.attack_scale(self.omega))
+            else:
+                behavior_mask = (traffic > 0)
+                behavior = np.where(behavior_mask, params.beta_u + params.sigma_u * noise, 0.0)
+        return turns, uniforms, traffic, behavior_mask, behavior
+
+
+    @staticmethod
+    def outside(bounds, name, values):
+        """
+        Return a mask of the values that fall outside the interval bounds
+        has for name (none of them, if it has none).
+        """
+        if (name not in bounds):
+            return np.zeros(len(values), dtype=bool)
+        low, high = bounds[name]
+        return (values < low) | (values > high)
+
+
     def calculate_attacker_fitness(self):
         """
         Calculate and return fitness for the attacker based on game state
         """
-        return self.attacker_reward * self.rho ** (self.t - 1)
+        return self.attacker_reward * self.params.attacker_discount(self.t)
 
     def calculate_defender_fitness(self):
         """
@@ -278,8 +463,74 @@ class GameState:
         # Here we make the tradeoff between service and security.
         # If only judged by amount of information lost, the defender
         # will ALWAYS block, which provides terrible service.
-        return (self.user_bonus * (self.A_u)\
-            - self.attacker_penalty * (self.attacker_reward)) / self.t
+        return (self.params.user_bonus * (self.A_u)\
+            - self.params.attacker_penalty * (self.attacker_reward)) / self.t
+
+class WorldTrace:
+    """
+    Record of the moves made during a game, kept at one of three levels:
+
+        off      nothing is recorded
+        compact  each turn appends the attacker's and defender's action codes
+                 to a preallocated array('b')
+        full     each turn appends an 'attacker: ... vs. defender: ...' line
+
+    Iterating over a trace yields the world file lines for whatever was
+    recorded.
+    """
+
+    LEVELS = ['off', 'compact', 'full']
+
+
+    def __init__(self, level, capacity = 0):
+        """
+        Set up an empty trace at the given level, with room for capacity
+        turns if compact.
+        """
+        self.level = level
+        self.num_turns = 0
+        self.lines = []
+        self.codes = None
+        if (level == 'compact'):
+            self.codes = array('b', bytes(2 * int(capacity)))
+        elif (level == 'off'):
+            # Nothing to do each turn
+            self.record = self.record_nothing
+
+
+    def record(self, attacker_move, defender_move):
+        """
+        Record one turn's moves.
+        """
+        if (self.level == 'full'):
+            self.lines.append('attacker: ' + attacker_move + ' vs. defender: '
+                              + defender_move + '\n')
+        else:
+            if (2 * self.num_turns >= len(self.codes)):
+                self.codes.extend(bytes(max(len(self.codes), 2)))
+            self.codes[2 * self.num_turns] = GameState.ACTION_CODES[attacker_move]
+            self.codes[2 * self.num_turns + 1] = GameState.ACTION_CODES[defender_move]
+        self.num_turns += 1
+
+
+    def record_nothing(self, attacker_move, defender_move):
+        """
+        Stand-in for record when the trace is off.
+        """
+        pass
+
+
+    def __iter__(self):
+        """
+        Yield the recorded turns as world file lines.
+        """
+        if (self.level == 'compact'):
+            for turn in range(self.num_turns):
+                yield ('attacker: ' + GameState.ACTIONS[self.codes[2 * turn]]
+                       + ' vs. defender: ' + GameState.ACTIONS[self.codes[2 * turn + 1]] + '\n')
+        else:
+            yield from self.lines
+
 
 """
 
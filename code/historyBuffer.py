@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+class HistoryBuffer:
+    """
+    Per-turn history of one game value, stored in a preallocated NumPy array.
+
+    A full buffer keeps every value appended to it (growing if a game runs
+    past its expected length); a ring buffer keeps only the last capacity
+    values, overwriting the oldest.
+    """
+
+    __slots__ = ('values', 'capacity', 'count', 'ring')
+
+
+    def __init__(self, capacity, dtype, ring = False):
+        """
+        Set up an empty buffer with room for capacity values of dtype.
+        """
+        self.capacity = max(int(capacity), 1)
+        self.values = np.zeros(self.capacity, dtype = dtype)
+        self.count = 0
+        self.ring = ring
+
+
+    def append(self, value):
+        """
+        Add the value for the next turn.
+        """
+        if (self.ring):
+            self.values[self.count % self.capacity] = value
+        else:
+            if (self.count >= self.capacity):
+                self.values = np.concatenate((self.values, np.zeros_like(self.values)))
+                self.capacity *= 2
+            self.values[self.count] = value
+        self.count += 1
+
+
+    def extend(self, values):
+        """
+        Add the values for the next len(values) turns.
+        """
+        num_new = len(values)
+        if (self.ring):
+            # Only the last capacity values survive
+            kept = values[-self.capacity:]
+            first = self.count + num_new - len(kept)
+            self.values[(first + np.arange(len(kept))) % self.capacity] = kept
+        else:
+            while (self.count + num_new > self.capacity):
+                self.values = np.concatenate((self.values, np.zeros_like(self.values)))
+                self.capacity *= 2
+            self.values[self.count:self.count + num_new] = values
+        self.count += num_new
+
+
+    def last(self):
+        """
+        Return the most recently added value.
+        """
+        return self.values[(self.count - 1) % self.capacity]
+
+
+    def __len__(self):
+        """
+        Return the number of values held.
+        """
+        return min(self.count, self.capacity)
+
+
+    def to_array(self):
+        """
+        Return the values held, oldest first.
+        """
+        if (self.count <= self.capacity):
+            return self.values[:self.count].copy()
+        split = self.count % self.capacity
+        return np.concatenate((self.values[split:], self.values[:split]))
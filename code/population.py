@@ -1,5 +1,4 @@
 # -*- coding: utf-8 -*-
-import copy
 
 class Population():
     """
@@ -26,6 +25,7 @@ class Population():
 
         self.individuals = None  # list of ExprTree instances
         self.best_individuals = [] # list of best individuals of each generation
+        self.generation_stats = [] # (eval count, gen_stats()) of each generation
 
         # Per-run bookkeeping values
         self.run_high_fitness = float('-inf')
@@ -54,6 +54,7 @@ class Population():
         """
         self.individuals = None
         self.best_individuals = []
+        self.generation_stats = []
         self.run_high_fitness = float('-inf')
         self.run_high_score = float('-inf')
         self.run_best_world_data = None
@@ -103,7 +104,7 @@ class Population():
             self.gen_fitness_total += individual.fitness
             if (individual.fitness > self.gen_high_fitness):
                 self.gen_high_fitness = individual.fitness
-                self.gen_best_individual = copy.deepcopy(individual)
+                self.gen_best_individual = individual
             self.gen_score_total += individual.score
             if (individual.score > self.gen_high_score):
                 self.gen_high_score = individual.score
@@ -114,25 +115,65 @@ class Population():
             if (individual.root.size > self.gen_max_tree_size):
                 self.gen_max_tree_size = individual.root.size
 
-        # Save off best individual of the generation
-        self.best_individuals.append(copy.deepcopy(self.gen_best_individual))
+        # Save off best individual of the generation. Its nodes never change,
+        # so a copy sharing them keeps it (and its fitness) as it is now.
+        self.gen_best_individual = self.gen_best_individual.copy()
+        self.best_individuals.append(self.gen_best_individual)
+
+
+    def gen_stats(self):
+        """
+        Return the current generation's stats that go in the logs, as totals
+        and highs that can be taken together across islands (see
+        combine_gen_stats).
+        """
+        return (len(self.individuals), self.gen_fitness_total, self.gen_high_fitness,
+                self.gen_tree_height_total, self.gen_max_tree_height,
+                self.gen_tree_size_total, self.gen_max_tree_size,
+                self.gen_score_total, self.gen_high_score)
+
+
+    @staticmethod
+    def combine_gen_stats(stats_list):
+        """
+        Return the gen stats of several islands' generations taken together,
+        as if they were one population's.
+        """
+        columns = list(zip(*stats_list))
+        return (sum(columns[0]), sum(columns[1]), max(columns[2]),
+                sum(columns[3]), max(columns[4]),
+                sum(columns[5]), max(columns[6]),
+                sum(columns[7]), max(columns[8]))
 
 
     def update_logs(self, eval_count, experiment_log, parsimony_log):
         """
         Update the experiment and parsimony logs
         """
+        stats = self.gen_stats()
+        self.generation_stats.append((eval_count, stats))
+        Population.write_logs(self.pop_name, eval_count, stats, experiment_log, parsimony_log)
+
+
+    @staticmethod
+    def write_logs(pop_name, eval_count, stats, experiment_log, parsimony_log):
+        """
+        Write a generation's lines to the experiment and parsimony logs given
+        its gen stats
+        """
+        num_individuals, fitness_total, high_fitness, tree_height_total, max_tree_height, \
+            tree_size_total, max_tree_size, score_total, high_score = stats
+
         # Update log
-        experiment_log.write(self.pop_name + '\t' + str(eval_count) + '\t' \
-                             + str(self.gen_fitness_total / len(self.individuals)) + '\t'
-                             + str(self.gen_high_fitness) + '\n')
+        experiment_log.write(pop_name + '\t' + str(eval_count) + '\t' \
+                             + str(fitness_total / num_individuals) + '\t'
+                             + str(high_fitness) + '\n')
 
         # Update parsimony log
-        parsimony_log.write(self.pop_name + '\t' + str(eval_count) + '\t' \
-                            + str(self.gen_tree_height_total / len(self.individuals)) + '\t'
-                            + str(self.gen_max_tree_height) + '\t'
-                            + str(self.gen_tree_size_total / len(self.individuals)) + '\t'
-                            + str(self.gen_max_tree_size) + '\t'
-                            + str(self.gen_score_total / len(self.individuals)) + '\t'
-                            + str(self.gen_high_score) + '\n')
-
+        parsimony_log.write(pop_name + '\t' + str(eval_count) + '\t' \
+                            + str(tree_height_total / num_individuals) + '\t'
+                            + str(max_tree_height) + '\t'
+                            + str(tree_size_total / num_individuals) + '\t'
+                            + str(max_tree_size) + '\t'
+                            + str(score_total / num_individuals) + '\t'
+                            + str(high_score) + '\n')
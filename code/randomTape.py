@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+class RandomTape:
+    """
+    Pre-drawn random numbers for one or more games ("rows").
+
+    Instead of making scalar random calls every turn, each game's user
+    traffic, behavior noise, and uniform draws are drawn in bulk and the turn
+    loop reads them by turn index. Row i, turn t (1-based) holds:
+
+        traffic[i, t - 1]            ~ Poisson(lambda_u)
+        noise[i, t - 1]              ~ N(0, 1), scaled to the behavior model
+        uniforms[i, t - 1, column]   ~ U(0, 1) for each of the columns below
+
+    Every row and variable has its own numpy Generator, so the values a game
+    sees depend only on its seed and not on how far or in what chunks the
+    tape has been drawn. The tape starts out short and extends itself when a
+    game outlives it.
+    """
+
+    # Uniform columns
+    UNBLOCK = 0  # compared against q to decide whether a blocked game stays blocked
+    LISTEN = 1   # compared against delta_l to decide whether listening is detected
+    ATTACK = 2   # compared against delta_a to decide whether an attack is detected
+    NUM_UNIFORMS = 3
+
+    # Number of turns drawn at a time (most games end well short of the limit)
+    CHUNK = 128
+
+
+    def __init__(self, seeds, lambda_u, length = CHUNK):
+        """
+        Set up a tape with one row per seed (an int or a numpy SeedSequence)
+        and draw the first length turns of each.
+        """
+        self.lambda_u = lambda_u
+        self.num_rows = len(seeds)
+        self.length = 0
+
+        # One Generator per row for each of traffic, noise and uniforms
+        self.generators = []
+        for seed in seeds:
+            if (not isinstance(seed, np.random.SeedSequence)):
+                seed = np.random.SeedSequence(seed)
+            # Derive the child streams without spawning from (and so changing)
+            # a SeedSequence that may be shared with other tapes
+            self.generators.append([np.random.default_rng(
+                np.random.SeedSequence(seed.entropy, spawn_key = seed.spawn_key + (stream,)))
+                for stream in range(3)])
+
+        self.traffic = np.zeros((self.num_rows, 0), dtype=np.int64)
+        self.noise = np.zeros((self.num_rows, 0))
+        self.uniforms = np.zeros((self.num_rows, 0, RandomTape.NUM_UNIFORMS))
+        self.extend(length)
+
+
+    def extend(self, length):
+        """
+        Draw more turns for every row so the tape is at least length long.
+        """
+        num_new = int(length) - self.length
+        if (num_new <= 0):
+            return
+        traffic = np.empty((self.num_rows, num_new), dtype=np.int64)
+        noise = np.empty((self.num_rows, num_new))
+        uniforms = np.empty((self.num_rows, num_new, RandomTape.NUM_UNIFORMS))
+        for row, (traffic_gen, noise_gen, uniform_gen) in enumerate(self.generators):
+            traffic[row] = traffic_gen.poisson(self.lambda_u, num_new)
+            noise[row] = noise_gen.standard_normal(num_new)
+            uniforms[row] = uniform_gen.random((num_new, RandomTape.NUM_UNIFORMS))
+        self.traffic = np.concatenate((self.traffic, traffic), axis = 1)
+        self.noise = np.concatenate((self.noise, noise), axis = 1)
+        self.uniforms = np.concatenate((self.uniforms, uniforms), axis = 1)
+        self.length += num_new
+
+
+    def ensure(self, turn):
+        """
+        Make sure the given (1-based) turn has been drawn, doubling the tape
+        length as needed.
+        """
+        if (turn > self.length):
+            self.extend(max(turn, 2 * self.length))
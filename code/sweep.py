@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import hashlib
+import itertools
+import traceback
+import contextlib
+import configparser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from experiment import Experiment
+
+class Sweep:
+    """
+    A parameter sweep: a base config plus a grid of values for some of its
+    options, expanded into one config per combination of values and one job
+    per run of each config.
+
+    Jobs are scheduled on a pool of worker processes. Every job works in a
+    directory of its own under the sweep's output root (with the usual logs,
+    data, plots, solutions and worlds folders), so the relative paths in the
+    config put its outputs there. Finished jobs are recorded in a ledger
+    (one JSON object per line) in the output root, and a sweep that is
+    started again skips the jobs the ledger says are done with the same
+    config, so a killed sweep picks up where it left off.
+
+    The sweep config looks like:
+
+        [sweep]
+        base_config = configs/default.cfg
+        output_root = sweeps/default
+        workers = 4
+
+        [grid]
+        lambda_u = 1, 3, 5
+        gen_evals = one_vs_one, all_vs_all
+
+    Grid options are looked up in whichever section of the base config has
+    them. Each run of a config is the same as that run of a whole experiment
+    with that config (each run takes its random numbers from its own seed),
+    as long as there's a random_seed, in the base config or in the sweep
+    section (which overrides the base config's).
+    """
+
+    OUTPUT_FOLDERS = ['logs', 'data', 'plots', 'solutions', 'worlds']
+
+    def __init__(self, sweep_file_path):
+        """
+        Set up a sweep given the path of its sweep config.
+        """
+        self.base_config_path = 'configs/default.cfg'
+        self.output_root = 'sweeps/default'
+        self.workers = 1
+        self.random_seed = None  # if given, overrides the base config's
+        self.grid = []  # (section, option, list of values) for each grid option
+
+        parser = configparser.ConfigParser()
+        parser.read(sweep_file_path)
+
+        try:
+            self.base_config_path = parser.get('sweep', 'base_config')
+            print('sweep: base_config =', self.base_config_path)
+        except:
+            print('sweep: base_config not specified; using', self.base_config_path)
+
+        try:
+            self.output_root = parser.get('sweep', 'output_root')
+            print('sweep: output_root =', self.output_root)
+        except:
+            print('sweep: output_root not specified; using', self.output_root)
+
+        try:
+            self.workers = parser.getint('sweep', 'workers')
+            print('sweep: workers =', self.workers)
+        except:
+            print('sweep: workers not specified; using', self.workers)
+
+        try:
+            self.random_seed = parser.getint('sweep', 'random_seed')
+            print('sweep: random_seed =', self.random_seed)
+        except:
+            print('sweep: random_seed not specified; using the base config\'s')
+
+        self.base_config = configparser.ConfigParser()
+        # Keep option names as they are (IDLess)
+        self.base_config.optionxform = str
+        if (len(self.base_config.read(self.base_config_path)) == 0):
+            print('sweep: problem with base config', self.base_config_path)
+            sys.exit(1)
+        if (self.random_seed is not None):
+            self.base_config.set('basic_options', 'random_seed', str(self.random_seed))
+        if (not self.base_config.has_option('basic_options', 'random_seed')):
+            print('sweep: base config has no random_seed, so jobs will not be reproducible')
+
+        if (parser.has_section('grid')):
+            for option, values in parser.items('grid'):
+                sections = [section for section in self.base_config.sections()
+                            if (option in [name.lower() for name in self.base_config.options(section)])]
+                if (len(sections) != 1):
+                    print('sweep: grid option', option, 'is in', len(sections),
+                          'sections of the base config instead of one')
+                    sys.exit(1)
+                self.grid.append((sections[0], self.option_name(sections[0], option),
+                                  [value.strip() for value in values.split(',')]))
+                print('sweep: grid', self.grid[-1][1], '=', self.grid[-1][2])
+
+        self.ledger_path = os.path.join(self.output_root, 'ledger.jsonl')
+
+
+    def option_name(self, section, option):
+        """
+        Return the name the base config gives the option (grid option names
+        come back lowercased from the sweep config).
+        """
+        for name in self.base_config.options(section):
+            if (name.lower() == option):
+                return name
+
+
+    def configs(self):
+        """
+        Return a (name, config text) pair for each combination of grid
+        values, the name spelling out the values.
+        """
+        configs = []
+        for values in itertools.product(*[option_values for _, _, option_values in self.grid]):
+            config = configparser.ConfigParser()
+            config.optionxform = str
+            config.read_dict(self.base_config)
+            for (section, option, _), value in zip(self.grid, values):
+                config.set(section, option, value)
+            # Runs are the sweep's jobs, so each job executes one run itself
+            config.set('basic_options', 'run_workers', '0')
+            name = ','.join(option + '=' + value
+                            for (_, option, _), value in zip(self.grid, values)) or 'base'
+            lines = []
+            for section in config.sections():
+                lines.append('[' + section + ']\n')
+                lines += [option + ' = ' + value + '\n' for option, value in config.items(section, raw = True)]
+                lines.append('\n')
+            configs.append((name, ''.join(lines)))
+        return configs
+
+
+    def jobs(self):
+        """
+        Return every job of the sweep as a dict: its id, config name, run,
+        config text and the hash of the text, and its directory.
+        """
+        jobs = []
+        for name, text in self.configs():
+            config = configparser.ConfigParser()
+            config.read_string(text)
+            num_runs = config.getint('basic_options', 'num_runs_per_experiment', fallback = 1)
+            digest = hashlib.blake2b(text.encode(), digest_size = 16).hexdigest()
+            for curr_run in range(1, num_runs + 1):
+                job_id = name + '/run' + str(curr_run)
+                jobs.append({'id': job_id, 'config': name, 'run': curr_run, 'text': text,
+                             'config_hash': digest,
+                             'root': os.path.abspath(os.path.join(self.output_root, job_id))})
+        return jobs
+
+
+    def finished(self):
+        """
+        Return the set of (job id, config hash) of the jobs the ledger says
+        are done. A line cut short by a killed sweep is ignored.
+        """
+        done = set()
+        if (not os.path.exists(self.ledger_path)):
+            return done
+        with open(self.ledger_path) as ledger:
+            for line in ledger:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if (entry.get('status') == 'done'):
+                    done.add((entry['id'], entry['config_hash']))
+        return done
+
+
+    def record(self, ledger, job, status, **details):
+        """
+        Append a job's status to the ledger, making sure it reaches the disk.
+        """
+        entry = {'id': job['id'], 'config_hash': job['config_hash'], 'status': status,
+                 'time': time.time()}
+        entry.update(details)
+        ledger.write(json.dumps(entry) + '\n')
+        ledger.flush()
+        os.fsync(ledger.fileno())
+
+
+    def run(self):
+        """
+        Run every job the ledger doesn't already have as done, on a pool of
+        worker processes, recording each one in the ledger as it finishes.
+        """
+        start_time = time.time()
+        os.makedirs(self.output_root, exist_ok = True)
+        jobs = self.jobs()
+        done = self.finished()
+        pending = [job for job in jobs if ((job['id'], job['config_hash']) not in done)]
+        print('sweep:', len(jobs), 'jobs,', len(jobs) - len(pending), 'already done')
+
+        failures = 0
+        with open(self.ledger_path, 'a') as ledger, \
+             ProcessPoolExecutor(max_workers = self.workers) as executor:
+            # Finish off a line cut short by a killed sweep, so the next
+            # entry starts a line of its own
+            if (ledger.tell() > 0):
+                with open(self.ledger_path, 'rb') as previous:
+                    previous.seek(-1, os.SEEK_END)
+                    if (previous.read(1) != b'\n'):
+                        ledger.write('\n')
+            futures = {executor.submit(Sweep.execute_job, job): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    seconds = future.result()
+                    self.record(ledger, job, 'done', seconds = seconds)
+                    print('sweep: done', job['id'], 'in', seconds, 'seconds')
+                except Exception as error:
+                    failures += 1
+                    self.record(ledger, job, 'failed', error = repr(error))
+                    print('sweep: failed', job['id'] + ':', repr(error))
+
+        print('sweep:', len(pending) - failures, 'jobs done,', failures, 'failed in',
+              time.time() - start_time, 'seconds')
+
+
+    @staticmethod
+    def execute_job(job):
+        """
+        Execute a job in a worker process: write its config into its
+        directory, then execute its run there with the console output going
+        to output.txt. Return how many seconds it took.
+        """
+        start_time = time.time()
+        for folder in Sweep.OUTPUT_FOLDERS:
+            os.makedirs(os.path.join(job['root'], folder), exist_ok = True)
+        os.chdir(job['root'])
+        with open('config.cfg', 'w') as config_file:
+            config_file.write(job['text'])
+        with open('output.txt', 'w') as output, contextlib.redirect_stdout(output):
+            try:
+                experiment = Experiment('config.cfg')
+                experiment.run_experiment(runs = [job['run']])
+            except SystemExit as error:
+                # Bad options end the experiment with sys.exit; turn that into
+                # a failure of this job rather than of the whole sweep
+                raise RuntimeError('experiment exited with status ' + str(error.code)) from None
+            except:
+                traceback.print_exc(file = output)
+                raise
+        return time.time() - start_time
+
+
+def main():
+    """
+    Parse command line argument and run the sweep.
+    """
+    sweep_file_path = 'configs/sweep.cfg'
+
+    if (len(sys.argv) > 1):
+        sweep_file_path = sys.argv[1]
+    else:
+        print('No sweep config specified -- using', sweep_file_path)
+
+    Sweep(sweep_file_path).run()
+
+if __name__ == '__main__':
+    main()